@@ -0,0 +1,420 @@
+"""
+Benchmarks for the roleplay bot.
+
+Runs against local fake Telegram and DeepSeek servers, so no tokens or
+network access are needed.
+
+Usage:
+    python benchmark.py cold-start --runs 5 --output bench_output.json
+    python benchmark.py replay --output replay.json --baseline previous_replay.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+from aiohttp import web
+
+from fake_deepseek_server import FakeDeepSeekServer
+from utils import percentile
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telegram_bot_main.py")
+
+class FakeTelegramServer:
+    """Minimal Telegram Bot API serving one queued update."""
+
+    def __init__(self):
+        self.updates: List[Dict[str, Any]] = []
+        self.sent: List[Dict[str, Any]] = []
+        self.first_reply = asyncio.Event()
+        self.first_reply_at: Optional[float] = None
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/getMe", self.get_me)
+        self.app.router.add_route("*", "/bot{token}/getUpdates", self.get_updates)
+        self.app.router.add_route("*", "/bot{token}/sendMessage", self.send_message)
+
+    def queue_message(self, text: str, user_id: int = 1, chat_id: int = 1):
+        """Queue a private text message for the bot."""
+        update_id = len(self.updates) + 1
+        self.updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "from": {"id": user_id, "first_name": "Йонас"},
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text
+            }
+        })
+
+    async def get_me(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "result": {"username": "bench_bot", "first_name": "Bench"}})
+
+    async def get_updates(self, request: web.Request) -> web.Response:
+        offset = int(request.query.get("offset", 0))
+        pending = [u for u in self.updates if u["update_id"] >= offset]
+        if not pending:
+            await asyncio.sleep(0.05)
+        return web.json_response({"ok": True, "result": pending})
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.sent.append(data)
+        if self.first_reply_at is None:
+            self.first_reply_at = time.perf_counter()
+            self.first_reply.set()
+        return web.json_response({"ok": True, "result": {"message_id": len(self.sent)}})
+
+    async def start(self, host: str = "127.0.0.1") -> str:
+        """Start serving and return the API base URL."""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, 0)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+async def _cold_start_once(deepseek_url: str, tmp_dir: str, timeout: float) -> float:
+    telegram = FakeTelegramServer()
+    telegram.queue_message("Йонас осматривается по сторонам")
+    telegram_url = await telegram.start()
+
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="bench",
+        DEEPSEEK_API_KEY="bench",
+        TELEGRAM_API_URL=telegram_url,
+        DEEPSEEK_URLS=deepseek_url,
+        # A fresh queue per run, otherwise the persisted offset skips the queued update
+        QUEUE_DB_PATH=os.path.join(tmp_dir, f"queue_{time.perf_counter_ns()}.sqlite3"),
+        USAGE_DB_PATH=os.path.join(tmp_dir, "usage.sqlite3"),
+        WORLD_STATE_ENABLED="false",
+        CONFIG_FILE=""
+    )
+
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, BOT_SCRIPT,
+        cwd=os.path.dirname(BOT_SCRIPT),
+        env=env,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+    try:
+        await asyncio.wait_for(telegram.first_reply.wait(), timeout)
+        return telegram.first_reply_at - started
+    finally:
+        process.terminate()
+        await process.wait()
+        await telegram.stop()
+
+async def bench_cold_start(runs: int, timeout: float) -> Dict[str, Any]:
+    """
+    Measure time from process start to the first reply sent to Telegram.
+
+    Every run is a fresh process that parses the lore text in the background.
+    """
+    deepseek = FakeDeepSeekServer(delay=0.0)
+    deepseek_url = await deepseek.start()
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        samples = [await _cold_start_once(deepseek_url, tmp_dir, timeout) for _ in range(runs)]
+        results["parse_lore"] = {
+            "runs": runs,
+            "mean_ms": statistics.mean(samples) * 1000,
+            "min_ms": min(samples) * 1000,
+            "max_ms": max(samples) * 1000
+        }
+
+    await deepseek.stop()
+    return {"benchmark": "cold_start_to_first_reply", "results": results}
+
+# A player's turn in the transcripts: a short paragraph-opening line about the hero
+PLAYER_NAME = "Йонас"
+MAX_TURN_LENGTH = 200
+# Non-blank transcript lines before and after a turn that count as its reference passages
+REFERENCE_CONTEXT_LINES = 8
+# Capitalized words used as entities for the entity recall score
+ENTITY_PATTERN = re.compile(r"\b[А-ЯЁA-Z][а-яёa-z0-9-]{3,}")
+
+class Turn:
+    """One recorded player turn with the narrator's reply and reference passages."""
+
+    def __init__(self, source: str, user_text: str, reply: str, references: List[str]):
+        self.source = source
+        self.user_text = user_text
+        self.reply = reply
+        self.references = references
+
+def extract_turns(path: str) -> List[Turn]:
+    """
+    Split a roleplay transcript into player turns.
+
+    A turn starts with a short line beginning with the player's name right
+    after a blank line and directly followed by narration. Following lines
+    of the player's speech ("Йонас: ...") belong to the same turn. The
+    narration up to the next turn is the recorded reply.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f.read().split("\n")]
+
+    starts = []
+    for i, line in enumerate(lines):
+        if (
+            line.startswith(PLAYER_NAME) and len(line) < MAX_TURN_LENGTH
+            and i > 0 and not lines[i - 1]
+            and i + 1 < len(lines) and lines[i + 1]
+        ):
+            starts.append(i)
+
+    turns = []
+    for n, start in enumerate(starts):
+        end = start + 1
+        while end < len(lines) and lines[end].startswith(f"{PLAYER_NAME}:") and len(lines[end]) < MAX_TURN_LENGTH:
+            end += 1
+
+        next_start = starts[n + 1] if n + 1 < len(starts) else len(lines)
+        user_text = "\n".join(lines[start:end])
+        reply_lines = [line for line in lines[end:next_start] if line]
+
+        before = [line for line in lines[:start] if line][-REFERENCE_CONTEXT_LINES:]
+        references = before + reply_lines[:REFERENCE_CONTEXT_LINES]
+        if reply_lines:
+            turns.append(Turn(os.path.basename(path), user_text, "\n".join(reply_lines), references))
+    return turns
+
+def _entity_recall(references: List[str], text: str) -> float:
+    reference_entities = set(ENTITY_PATTERN.findall(" ".join(references))) - {PLAYER_NAME}
+    if not reference_entities:
+        return 1.0
+    return len(reference_entities & set(ENTITY_PATTERN.findall(text))) / len(reference_entities)
+
+def score_prompt(prompt_text: str, references: List[str]) -> Tuple[float, float]:
+    """
+    Score the lore and history that actually went into a turn's prompt.
+
+    Returns:
+        (passage_recall, entity_recall): share of reference lines contained
+        in the prompt, and share of named entities of the references that
+        appear in it
+    """
+    if not references:
+        return 1.0, 1.0
+    passage_recall = sum(1 for line in references if line in prompt_text) / len(references)
+    return passage_recall, _entity_recall(references, prompt_text)
+
+def score_retrieval(retrieved: List[str], references: List[str]) -> Tuple[float, float]:
+    """
+    Score lines found by LoreManager.search_lore against the reference passages of a turn.
+
+    The bot does not search the lore when building prompts; this scores the
+    search as a candidate retrieval step.
+
+    Returns:
+        (passage_recall, entity_recall): share of reference lines retrieved,
+        capped by the number of retrieved slots, and share of named entities
+        of the references that appear in the retrieved lines
+    """
+    reference_set = set(references)
+    slots = min(len(reference_set), max(len(retrieved), 1))
+    passage_recall = len(reference_set & set(retrieved)) / slots if slots else 0.0
+
+    return passage_recall, _entity_recall(references, " ".join(retrieved))
+
+def _summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "mean": statistics.mean(values) if values else 0.0,
+        "p50": percentile(values, 0.5) or 0.0,
+        "p95": percentile(values, 0.95) or 0.0,
+        "max": max(values, default=0.0)
+    }
+
+def _mean(values: List[float]) -> float:
+    return statistics.mean(values) if values else 0.0
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(BOT_SCRIPT)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+async def bench_replay(transcripts: List[str], max_turns: int) -> Dict[str, Any]:
+    """
+    Replay recorded sessions through the prompt pipeline.
+
+    Every transcript is replayed as one session of the real bot against a
+    fake DeepSeek server. The recorded narration, not the fake answer, is
+    added to the history, and the next turn is pre-warmed as after a real
+    reply.
+
+    Lore fidelity is scored on the prompt actually sent (prompt_* recall).
+    The prompt embeds the whole lore, so it has no retrieval step; search_*
+    metrics score LoreManager.search_lore separately as a candidate for one.
+    """
+    deepseek = FakeDeepSeekServer(delay=0.0)
+    deepseek_url = await deepseek.start()
+
+    os.environ.update(
+        TELEGRAM_BOT_TOKEN="bench",
+        DEEPSEEK_API_KEY="bench",
+        DEEPSEEK_URLS=deepseek_url,
+        WORLD_STATE_ENABLED="false",
+        USAGE_DB_PATH="",
+        QUEUE_DB_PATH="",
+        CONFIG_FILE=""
+    )
+    import telegram_bot_main
+    from deepseek_client import encode_messages
+    logging.getLogger().setLevel(logging.WARNING)
+
+    bot = telegram_bot_main.TelegramBot("bench")
+    await bot.lore_manager.load_lore_async()
+    records = []
+
+    try:
+        for session_id, path in enumerate(transcripts, start=1):
+            history = []
+            for turn in extract_turns(path)[:max_turns or None]:
+                history.append({"role": "user", "content": turn.user_text})
+                history = history[-bot.config.MAX_HISTORY_LENGTH:]
+                hits_before = bot.prompt_prewarmer.hits
+
+                # Prompt build: the same steps get_deepseek_response takes before the request
+                started = time.perf_counter()
+                system_prompt, messages = bot.build_prompt(session_id, bot.config.SYSTEM_PROMPT, history)
+                prefix = await bot.prompt_prewarmer.get_prefix(session_id, system_prompt, messages[:-1])
+                encode_messages(messages[-1:])
+                build_time = time.perf_counter() - started
+
+                # Not part of the prompt pipeline: measured as a candidate retrieval step
+                started = time.perf_counter()
+                retrieved = bot.lore_manager.search_lore(turn.user_text)
+                search_time = time.perf_counter() - started
+
+                started = time.perf_counter()
+                await bot.deepseek_client.get_response(messages[-1:], encoded_prefix=prefix)
+                upstream_time = time.perf_counter() - started
+
+                prompt_text = "\n".join([system_prompt] + [m["content"] for m in messages])
+                prompt_passage_recall, prompt_entity_recall = score_prompt(prompt_text, turn.references)
+                search_passage_recall, search_entity_recall = score_retrieval(retrieved, turn.references)
+                prompt_chars = len(system_prompt) + sum(len(m["content"]) for m in messages)
+                records.append({
+                    "source": turn.source,
+                    "turn": len(records) + 1,
+                    "messages": len(messages) + 1,
+                    "prompt_chars": prompt_chars,
+                    "prompt_bytes": len(prefix) + len(encode_messages(messages[-1:])),
+                    "build_ms": build_time * 1000,
+                    "upstream_ms": upstream_time * 1000,
+                    "prewarm_hit": bot.prompt_prewarmer.hits > hits_before,
+                    "prompt_passage_recall": prompt_passage_recall,
+                    "prompt_entity_recall": prompt_entity_recall,
+                    "search_ms": search_time * 1000,
+                    "search_results": len(retrieved),
+                    "search_passage_recall": search_passage_recall,
+                    "search_entity_recall": search_entity_recall
+                })
+
+                history.append({"role": "assistant", "content": turn.reply})
+                bot.schedule_prewarm(session_id, history, bot.config.MAX_HISTORY_LENGTH)
+                # The player takes far longer to answer than pre-warming takes
+                await asyncio.gather(*bot.prompt_prewarmer.tasks)
+    finally:
+        await bot.close()
+        await deepseek.stop()
+
+    return {
+        "benchmark": "replay",
+        "revision": _git_revision(),
+        "lore_version": bot.lore_manager.version,
+        "transcripts": [os.path.basename(path) for path in transcripts],
+        "turns": len(records),
+        "notes": (
+            "prompt_* recall scores the prompt actually sent, which embeds the whole lore. "
+            "search_* scores LoreManager.search_lore, which the prompt pipeline does not use."
+        ),
+        "summary": {
+            "prompt_chars": _summarize([r["prompt_chars"] for r in records]),
+            "build_ms": _summarize([r["build_ms"] for r in records]),
+            "upstream_ms": _summarize([r["upstream_ms"] for r in records]),
+            "prewarm_hit_rate": sum(r["prewarm_hit"] for r in records) / len(records) if records else 0.0,
+            "prompt_passage_recall": _mean([r["prompt_passage_recall"] for r in records]),
+            "prompt_entity_recall": _mean([r["prompt_entity_recall"] for r in records]),
+            "search_ms": _summarize([r["search_ms"] for r in records]),
+            "search_passage_recall": _mean([r["search_passage_recall"] for r in records]),
+            "search_entity_recall": _mean([r["search_entity_recall"] for r in records])
+        },
+        "records": records
+    }
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the change of every summary metric relative to a baseline report."""
+    def flatten(summary: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+        flat = {}
+        for key, value in summary.items():
+            if isinstance(value, dict):
+                flat.update(flatten(value, f"{prefix}{key}."))
+            else:
+                flat[f"{prefix}{key}"] = value
+        return flat
+
+    current = flatten(report["summary"])
+    previous = flatten(baseline.get("summary", {}))
+    return {
+        "baseline_revision": baseline.get("revision", ""),
+        "changes": {
+            key: {"baseline": previous[key], "current": value, "delta": value - previous[key]}
+            for key, value in current.items() if key in previous
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Roleplay bot benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    cold_start = subparsers.add_parser("cold-start", help="Time from process start to the first handled update")
+    cold_start.add_argument("--runs", type=int, default=5)
+    cold_start.add_argument("--timeout", type=float, default=60)
+    cold_start.add_argument("--output", help="Write the JSON report to this file")
+
+    replay = subparsers.add_parser("replay", help="Replay recorded sessions through the prompt pipeline")
+    replay.add_argument("transcripts", nargs="*", default=["lore1.txt", "lore2.txt"])
+    replay.add_argument("--max-turns", type=int, default=0, help="Turns per transcript, 0 for all")
+    replay.add_argument("--baseline", help="Previous JSON report to compare with")
+    replay.add_argument("--output", help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+
+    if args.command == "cold-start":
+        report = asyncio.run(bench_cold_start(args.runs, args.timeout))
+    elif args.command == "replay":
+        report = asyncio.run(bench_replay(args.transcripts, args.max_turns))
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                report["comparison"] = compare_reports(report, json.load(f))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
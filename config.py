@@ -3,7 +3,7 @@ Configuration module for the Telegram bot.
 """
 
 import os
-from typing import Optional
+from typing import List, Optional
 
 class Config:
     """Configuration class for bot settings."""
@@ -11,6 +11,7 @@ class Config:
     def __init__(self):
         # Telegram Bot Configuration
         self.TELEGRAM_BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
+        self.TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
         
         # DeepSeek API Configuration
         self.DEEPSEEK_API_KEY: str = os.getenv("DEEPSEEK_API_KEY", "")
@@ -20,6 +21,28 @@ class Config:
         )
         self.DEEPSEEK_MODEL: str = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
         
+        # Upstream endpoints (comma-separated OpenAI-compatible URLs and optional weights)
+        self.DEEPSEEK_URLS: List[str] = [
+            url.strip()
+            for url in os.getenv("DEEPSEEK_URLS", self.DEEPSEEK_URL).split(",")
+            if url.strip()
+        ]
+        self.DEEPSEEK_URL_WEIGHTS: List[float] = [
+            float(weight)
+            for weight in os.getenv("DEEPSEEK_URL_WEIGHTS", "").split(",")
+            if weight.strip()
+        ]
+        
+        # Hedging and failover
+        self.HEDGE_ENABLED: bool = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.HEDGE_PERCENTILE: float = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+        self.HEDGE_DEFAULT_DELAY: float = float(os.getenv("HEDGE_DEFAULT_DELAY", "5"))
+        self.HEDGE_MIN_DELAY: float = float(os.getenv("HEDGE_MIN_DELAY", "1.5"))
+        self.MAX_UPSTREAM_ATTEMPTS: int = int(os.getenv("MAX_UPSTREAM_ATTEMPTS", "3"))
+        self.ENDPOINT_FAILURE_THRESHOLD: int = int(os.getenv("ENDPOINT_FAILURE_THRESHOLD", "3"))
+        self.ENDPOINT_COOLDOWN: int = int(os.getenv("ENDPOINT_COOLDOWN", "30"))
+        self.UPSTREAM_RETRY_BACKOFF: float = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "1"))
+        
         # Bot Configuration
         self.SYSTEM_PROMPT: str = os.getenv(
             "SYSTEM_PROMPT",
@@ -30,6 +53,57 @@ class Config:
         self.MAX_HISTORY_LENGTH: int = int(os.getenv("MAX_HISTORY_LENGTH", "50"))
         self.REQUEST_TIMEOUT: int = int(os.getenv("REQUEST_TIMEOUT", "30"))
         
+        # Lore loading
+        self.LORE_READY_TIMEOUT: float = float(os.getenv("LORE_READY_TIMEOUT", "10"))
+        
+        # Durable update queue (empty path disables it)
+        self.QUEUE_DB_PATH: str = os.getenv("QUEUE_DB_PATH", "bot_queue.sqlite3")
+        self.QUEUE_RETENTION: float = float(os.getenv("QUEUE_RETENTION", "86400"))
+        
+        # Token accounting and quotas (0 means unlimited)
+        self.USAGE_DB_PATH: str = os.getenv("USAGE_DB_PATH", "usage.sqlite3")
+        self.USAGE_FLUSH_INTERVAL: float = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+        self.USER_DAILY_TOKEN_QUOTA: int = int(os.getenv("USER_DAILY_TOKEN_QUOTA", "0"))
+        self.CHAT_DAILY_TOKEN_QUOTA: int = int(os.getenv("CHAT_DAILY_TOKEN_QUOTA", "0"))
+        
+        # Prices in USD per million tokens, used for cost estimates
+        self.PRICE_INPUT_CACHE_HIT: float = float(os.getenv("PRICE_INPUT_CACHE_HIT", "0.028"))
+        self.PRICE_INPUT_CACHE_MISS: float = float(os.getenv("PRICE_INPUT_CACHE_MISS", "0.28"))
+        self.PRICE_OUTPUT: float = float(os.getenv("PRICE_OUTPUT", "0.42"))
+        
+        # Prepare the next turn's prompt right after a reply is sent
+        self.PROMPT_PREWARM_ENABLED: bool = os.getenv("PROMPT_PREWARM_ENABLED", "true").lower() in ("1", "true", "yes")
+        # Each prepared prompt with the full lore takes about 0.5 MB
+        self.PROMPT_PREWARM_MAX_SESSIONS: int = int(os.getenv("PROMPT_PREWARM_MAX_SESSIONS", "100"))
+        
+        # World-state memory
+        self.WORLD_STATE_ENABLED: bool = os.getenv("WORLD_STATE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.WORLD_STATE_HISTORY_LENGTH: int = int(os.getenv("WORLD_STATE_HISTORY_LENGTH", "16"))
+        
+        # Group-chat scenes
+        self.SCENE_MODE_ENABLED: bool = os.getenv("SCENE_MODE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.SCENE_ROUND_WINDOW: float = float(os.getenv("SCENE_ROUND_WINDOW", "20"))
+        self.SCENE_MAX_ROUND_ACTIONS: int = int(os.getenv("SCENE_MAX_ROUND_ACTIONS", "8"))
+        self.SCENE_MAX_CONCURRENT_ROUNDS: int = int(os.getenv("SCENE_MAX_CONCURRENT_ROUNDS", "4"))
+        
+        # Event loop health
+        self.LOOP_MONITOR_ENABLED: bool = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.LOOP_MONITOR_INTERVAL: float = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.25"))
+        self.LOOP_SLOW_CALLBACK_THRESHOLD: float = float(os.getenv("LOOP_SLOW_CALLBACK_THRESHOLD", "0.2"))
+        self.LOOP_MONITOR_LOG_INTERVAL: float = float(os.getenv("LOOP_MONITOR_LOG_INTERVAL", "60"))
+        self.BLOCKING_POOL_WORKERS: int = int(os.getenv("BLOCKING_POOL_WORKERS", "4"))
+        
+        # Hot-reloadable overrides of tunable settings (empty path disables the file)
+        self.CONFIG_FILE: str = os.getenv("CONFIG_FILE", "runtime_config.json")
+        self.CONFIG_RELOAD_INTERVAL: float = float(os.getenv("CONFIG_RELOAD_INTERVAL", "5"))
+        
+        # Administration (comma-separated Telegram user IDs)
+        self.ADMIN_USER_IDS: List[int] = [
+            int(user_id)
+            for user_id in os.getenv("ADMIN_USER_IDS", "").split(",")
+            if user_id.strip()
+        ]
+        
         # Rate limiting
         self.MAX_REQUESTS_PER_MINUTE: int = int(os.getenv("MAX_REQUESTS_PER_MINUTE", "10"))
         
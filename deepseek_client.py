@@ -2,110 +2,432 @@
 DeepSeek API client for generating AI responses.
 """
 
+import json
+import time
 import logging
 import asyncio
 import aiohttp
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set
 from config import Config
+from endpoint_pool import Endpoint, EndpointPool
+from utils import CHARS_PER_TOKEN
 
 logger = logging.getLogger(__name__)
 
+def encode_messages(messages: List[Dict[str, str]]) -> bytes:
+    """
+    Encode messages as the comma-separated body of a JSON array.
+
+    Encoded prefixes of a conversation can be joined with encoded new
+    messages by b", " without re-encoding the prefix.
+    """
+    return b", ".join(json.dumps(m, ensure_ascii=False).encode("utf-8") for m in messages)
+
+class DeepSeekAPIError(Exception):
+    """DeepSeek API error carrying a user-facing message."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class _Race:
+    """Shared state of concurrent attempts for a single request."""
+
+    def __init__(self):
+        self.winner: Optional[asyncio.Task] = None
+        self.first_token = asyncio.Event()
+
+    def claim(self) -> bool:
+        """Claim the request for the current attempt once it has produced a token."""
+        if self.winner is not None:
+            return self.winner is asyncio.current_task()
+        self.winner = asyncio.current_task()
+        self.first_token.set()
+        return True
+
 class DeepSeekClient:
     """Client for interacting with DeepSeek API."""
-    
+
     def __init__(self, config: Config):
         self.config = config
         self.session = None
-    
+        self.endpoint_pool = EndpointPool.from_config(config)
+        # Optional UsageTracker receiving token usage of every successful request
+        self.usage_tracker = None
+
     async def _get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session."""
         if self.session is None or self.session.closed:
             timeout = aiohttp.ClientTimeout(total=self.config.REQUEST_TIMEOUT)
             self.session = aiohttp.ClientSession(timeout=timeout)
         return self.session
-    
-    async def get_response(self, conversation_history: List[Dict[str, str]]) -> str:
+
+    async def get_response(
+        self,
+        conversation_history: List[Dict[str, str]],
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        usage_tags: Optional[Dict[str, Any]] = None,
+        encoded_prefix: Optional[bytes] = None,
+        record_latency: bool = True
+    ) -> str:
         """
         Get AI response from DeepSeek API.
-        
+
+        The request is sent to one of the configured endpoints. If no token
+        arrives within the endpoint's recent p95 first-token latency, a backup
+        request is sent to another healthy endpoint and whichever answers
+        first wins. Failed attempts fail over to the next endpoint, backing
+        off before an endpoint that already failed is tried again.
+
         Args:
             conversation_history: List of message dictionaries with 'role' and 'content'
-            
+            system_prompt: System prompt to use instead of the configured one
+            temperature: Sampling temperature
+            max_tokens: Maximum number of tokens in the answer
+            usage_tags: Attribution passed to the usage tracker
+                (user_id or user_ids, chat_id, lore_version, purpose)
+            encoded_prefix: Messages already encoded with encode_messages,
+                including the system prompt. When given, system_prompt is
+                ignored and conversation_history holds only the messages to append
+            record_latency: Whether the first-token latency feeds the endpoint's
+                hedging deadline; off for requests unlike chat replies
+
         Returns:
             AI response text
-            
+
         Raises:
-            Exception: If API request fails
+            DeepSeekAPIError: If API request fails
         """
-        try:
-            # Prepare the payload
+        if encoded_prefix is None:
             messages = [
-                {"role": "system", "content": self.config.SYSTEM_PROMPT}
+                {"role": "system", "content": system_prompt or self.config.SYSTEM_PROMPT}
             ] + conversation_history
-            
-            payload = {
-                "model": self.config.DEEPSEEK_MODEL,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2000
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.config.DEEPSEEK_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            session = await self._get_session()
-            
-            logger.debug(f"Sending request to DeepSeek API with {len(messages)} messages")
-            
-            async with session.post(
-                self.config.DEEPSEEK_URL,
-                json=payload,
-                headers=headers
-            ) as response:
-                
-                if response.status == 200:
-                    data = await response.json()
-                    ai_response = data["choices"][0]["message"]["content"]
-                    logger.debug(f"Received response: {ai_response[:100]}...")
-                    return ai_response
-                
-                elif response.status == 401:
-                    error_msg = "Ошибка авторизации. Проверьте API ключ DeepSeek."
+        else:
+            messages = conversation_history
+
+        parameters = {
+            "model": self.config.DEEPSEEK_MODEL,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+
+        logger.debug(f"Sending request to DeepSeek API with {len(messages)} new messages")
+
+        started = time.monotonic()
+        # Attempts cancelled in flight after another one won; each already sent the whole prompt
+        abandoned: List[Endpoint] = []
+        body = b""
+
+        try:
+            # The lore prompt is large; encode it once for all attempts
+            encoded = encode_messages(messages)
+            if encoded_prefix is not None:
+                encoded = encoded_prefix + b", " + encoded if encoded else encoded_prefix
+
+            # Messages go last so the encoded array can be spliced into the body
+            body = (
+                json.dumps(parameters).encode("utf-8")[:-1]
+                + b', "messages": [' + encoded + b"]}"
+            )
+            result = await self._dispatch(body, abandoned, record_latency)
+        except DeepSeekAPIError:
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected DeepSeek API error: {e}")
+            raise DeepSeekAPIError("Неизвестная ошибка при обращении к DeepSeek API.")
+        finally:
+            self._record_abandoned(body, len(abandoned), time.monotonic() - started, usage_tags)
+
+        logger.debug(f"Received response from {result['endpoint']}: {result['content'][:100]}...")
+
+        if self.usage_tracker is not None:
+            self.usage_tracker.record(
+                result["usage"],
+                time.monotonic() - started,
+                self.config.DEEPSEEK_MODEL,
+                **(usage_tags or {})
+            )
+
+        return result["content"]
+
+    def _record_abandoned(
+        self,
+        body: bytes,
+        count: int,
+        latency: float,
+        usage_tags: Optional[Dict[str, Any]]
+    ):
+        """
+        Record attempts cancelled in flight with purpose 'hedge'.
+
+        The upstream was already processing the whole prompt, so these are
+        billed even though no usage block arrives; the prompt tokens are
+        estimated from the request body. Attempts answered with an error
+        status are not billed and are not recorded.
+        """
+        if self.usage_tracker is None or not count or not body:
+            return
+
+        prompt_tokens = len(body.decode("utf-8", errors="ignore")) // CHARS_PER_TOKEN
+        for _ in range(count):
+            self.usage_tracker.record(
+                {"prompt_tokens": prompt_tokens, "completion_tokens": 0},
+                latency,
+                self.config.DEEPSEEK_MODEL,
+                **dict(usage_tags or {}, purpose="hedge")
+            )
+
+    async def _dispatch(
+        self,
+        body: bytes,
+        abandoned: Optional[List[Endpoint]] = None,
+        record_latency: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Run a request with hedging and failover across endpoints.
+
+        Args:
+            body: Encoded chat completions request body
+            abandoned: List receiving the endpoints of attempts cancelled in flight
+            record_latency: Whether the winner's first-token latency is sampled
+
+        Returns:
+            Result of the winning attempt
+        """
+        abandoned = abandoned if abandoned is not None else []
+        race = _Race()
+        used: List[Endpoint] = []
+        pending = set()
+        last_error: Optional[Exception] = None
+        retries = 0
+        first_token_waiter = asyncio.ensure_future(race.first_token.wait())
+
+        endpoints: Dict[asyncio.Task, Endpoint] = {}
+        cancelled = set()
+
+        def launch():
+            endpoint = self.endpoint_pool.choose(exclude=used)
+            used.append(endpoint)
+            task = asyncio.ensure_future(self._attempt(endpoint, body, race, record_latency))
+            endpoints[task] = endpoint
+            pending.add(task)
+
+        def abandon(task: asyncio.Task):
+            if task in cancelled:
+                return
+            cancelled.add(task)
+            # Still running, or lost the race after receiving tokens: the prompt was processed
+            if not task.done() or (not task.cancelled() and task.exception() is None):
+                abandoned.append(endpoints[task])
+            task.cancel()
+
+        try:
+            launch()
+
+            while True:
+                timeout = None
+                # A hedge to the same endpoint only doubles its load
+                if (
+                    self.config.HEDGE_ENABLED
+                    and len(used) < self.config.MAX_UPSTREAM_ATTEMPTS
+                    and self.endpoint_pool.has_alternative(exclude=used)
+                ):
+                    timeout = self.endpoint_pool.hedge_delay(
+                        used[-1],
+                        self.config.HEDGE_PERCENTILE,
+                        self.config.HEDGE_DEFAULT_DELAY,
+                        self.config.HEDGE_MIN_DELAY
+                    )
+
+                done, _ = await asyncio.wait(
+                    pending | {first_token_waiter},
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if race.winner is not None:
+                    winner = race.winner
+                    for task in pending:
+                        if task is not winner:
+                            abandon(task)
+                    pending.discard(winner)
+                    return await winner
+
+                if not done:
+                    logger.info(
+                        f"No first token from {used[-1].url} after {timeout:.2f}s, "
+                        f"sending hedged request"
+                    )
+                    launch()
+                    continue
+
+                for task in done:
+                    pending.discard(task)
+                    error = task.exception()
+                    if error is None:
+                        continue
+                    last_error = error
+                    if isinstance(error, DeepSeekAPIError) and not error.retryable:
+                        raise error
+
+                if not pending:
+                    if len(used) >= self.config.MAX_UPSTREAM_ATTEMPTS:
+                        raise last_error
+                    if not self.endpoint_pool.has_alternative(exclude=used):
+                        # Only endpoints that already failed are left: give them time to recover
+                        delay = self.config.UPSTREAM_RETRY_BACKOFF * 2 ** retries
+                        retries += 1
+                        logger.info(f"Retrying in {delay:.1f}s after error: {last_error}")
+                        await asyncio.sleep(delay)
+                    else:
+                        logger.info(f"Failing over after error: {last_error}")
+                    launch()
+        finally:
+            first_token_waiter.cancel()
+            for task in pending:
+                abandon(task)
+            if cancelled:
+                await asyncio.gather(*cancelled, return_exceptions=True)
+
+    async def _attempt(
+        self,
+        endpoint: Endpoint,
+        body: bytes,
+        race: _Race,
+        record_latency: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Send a single request to one endpoint and read the streamed answer.
+
+        Args:
+            endpoint: Endpoint to send the request to
+            body: Encoded chat completions request body
+            race: Shared state of the attempts for this request
+            record_latency: Whether the first-token latency is sampled
+
+        Returns:
+            Dictionary with 'content', 'usage', 'endpoint' and 'first_token_latency',
+            or None if another attempt won the race
+        """
+        headers = {
+            "Authorization": f"Bearer {self.config.DEEPSEEK_API_KEY}",
+            "Content-Type": "application/json; charset=utf-8"
+        }
+
+        session = await self._get_session()
+        endpoint.in_flight += 1
+        endpoint.total_requests += 1
+        started = time.monotonic()
+        first_token_latency = None
+
+        try:
+            # The timeout is read per request, so a reloaded REQUEST_TIMEOUT applies at once
+            timeout = aiohttp.ClientTimeout(total=self.config.REQUEST_TIMEOUT)
+            async with session.post(endpoint.url, data=body, headers=headers, timeout=timeout) as response:
+
+                if response.status == 401:
                     logger.error(f"DeepSeek API authorization failed: {response.status}")
-                    raise Exception(error_msg)
-                
+                    raise DeepSeekAPIError(
+                        "Ошибка авторизации. Проверьте API ключ DeepSeek.",
+                        retryable=False
+                    )
+
                 elif response.status == 429:
-                    error_msg = "Превышен лимит запросов к DeepSeek API. Попробуйте позже."
-                    logger.error(f"DeepSeek API rate limit exceeded: {response.status}")
-                    raise Exception(error_msg)
-                
-                else:
+                    logger.error(f"DeepSeek API rate limit exceeded at {endpoint.url}: {response.status}")
+                    raise DeepSeekAPIError("Превышен лимит запросов к DeepSeek API. Попробуйте позже.")
+
+                elif response.status != 200:
                     error_text = await response.text()
-                    error_msg = f"Ошибка DeepSeek API (код {response.status}). Попробуйте позже."
-                    logger.error(f"DeepSeek API error {response.status}: {error_text}")
-                    raise Exception(error_msg)
-                    
+                    logger.error(f"DeepSeek API error {response.status} at {endpoint.url}: {error_text}")
+                    raise DeepSeekAPIError(
+                        f"Ошибка DeepSeek API (код {response.status}). Попробуйте позже."
+                    )
+
+                content_parts: List[str] = []
+                usage = None
+
+                if response.content_type == "application/json":
+                    # Endpoint ignored the stream flag and returned the whole answer
+                    data = await response.json()
+                    content_parts.append(data["choices"][0]["message"]["content"])
+                    usage = data.get("usage")
+                else:
+                    async for raw_line in response.content:
+                        line = raw_line.strip()
+                        if not line.startswith(b"data:"):
+                            continue
+
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            break
+
+                        chunk = json.loads(data)
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                        for choice in chunk.get("choices") or []:
+                            delta = (choice.get("delta") or {}).get("content")
+                            if delta:
+                                content_parts.append(delta)
+
+                        if first_token_latency is None and content_parts:
+                            first_token_latency = time.monotonic() - started
+                            if not race.claim():
+                                return None
+
+                if first_token_latency is None:
+                    first_token_latency = time.monotonic() - started
+                    if not race.claim():
+                        return None
+
+                endpoint.record_success(first_token_latency if record_latency else None)
+                return {
+                    "content": "".join(content_parts),
+                    "usage": usage,
+                    "endpoint": endpoint.url,
+                    "first_token_latency": first_token_latency
+                }
+
+        except DeepSeekAPIError as e:
+            if e.retryable:
+                endpoint.record_failure(self.endpoint_pool.failure_threshold, self.endpoint_pool.cooldown)
+            raise
+
         except asyncio.TimeoutError:
-            error_msg = "Превышено время ожидания ответа от DeepSeek API."
-            logger.error("DeepSeek API request timeout")
-            raise Exception(error_msg)
-            
+            logger.error(f"DeepSeek API request timeout at {endpoint.url}")
+            endpoint.record_failure(self.endpoint_pool.failure_threshold, self.endpoint_pool.cooldown)
+            raise DeepSeekAPIError("Превышено время ожидания ответа от DeepSeek API.")
+
         except aiohttp.ClientError as e:
-            error_msg = "Ошибка соединения с DeepSeek API."
-            logger.error(f"DeepSeek API connection error: {e}")
-            raise Exception(error_msg)
-            
-        except Exception as e:
-            if "Ошибка" in str(e):
-                # Re-raise our custom error messages
-                raise e
-            else:
-                error_msg = "Неизвестная ошибка при обращении к DeepSeek API."
-                logger.error(f"Unexpected DeepSeek API error: {e}")
-                raise Exception(error_msg)
-    
+            logger.error(f"DeepSeek API connection error at {endpoint.url}: {e}")
+            endpoint.record_failure(self.endpoint_pool.failure_threshold, self.endpoint_pool.cooldown)
+            raise DeepSeekAPIError("Ошибка соединения с DeepSeek API.")
+
+        except (KeyError, IndexError, ValueError) as e:
+            logger.error(f"Malformed DeepSeek API response from {endpoint.url}: {e}")
+            endpoint.record_failure(self.endpoint_pool.failure_threshold, self.endpoint_pool.cooldown)
+            raise DeepSeekAPIError("Неизвестная ошибка при обращении к DeepSeek API.")
+
+        finally:
+            endpoint.in_flight -= 1
+
+    def apply_config(self, changed: Set[str]):
+        """Pick up reloaded routing settings (the others are read per request)."""
+        if changed & {"DEEPSEEK_URLS", "DEEPSEEK_URL_WEIGHTS"}:
+            self.endpoint_pool.reconfigure(
+                self.config.DEEPSEEK_URLS or [self.config.DEEPSEEK_URL],
+                self.config.DEEPSEEK_URL_WEIGHTS
+            )
+        self.endpoint_pool.failure_threshold = self.config.ENDPOINT_FAILURE_THRESHOLD
+        self.endpoint_pool.cooldown = self.config.ENDPOINT_COOLDOWN
+
+    def get_endpoint_stats(self) -> List[Dict[str, Any]]:
+        """Get health and latency statistics of the upstream endpoints."""
+        return self.endpoint_pool.get_stats()
+
     async def close(self):
         """Close the aiohttp session."""
         if self.session and not self.session.closed:
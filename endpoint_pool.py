@@ -0,0 +1,206 @@
+"""
+Pool of upstream chat completion endpoints with health and latency tracking.
+"""
+
+import time
+import random
+import logging
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Any
+from config import Config
+from utils import percentile
+
+logger = logging.getLogger(__name__)
+
+class Endpoint:
+    """Single OpenAI-compatible chat completions endpoint."""
+
+    def __init__(self, url: str, weight: float = 1.0, window: int = 100):
+        self.url = url
+        self.weight = weight
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_failures = 0
+
+    def is_healthy(self, now: Optional[float] = None) -> bool:
+        """Check whether the endpoint is outside of its failure cooldown."""
+        return (now or time.monotonic()) >= self.down_until
+
+    def record_success(self, first_token_latency: Optional[float] = None):
+        """
+        Record a successful request.
+
+        Args:
+            first_token_latency: Seconds from sending the request to the first token,
+                or None for requests that must not shape the hedging deadline
+        """
+        if first_token_latency is not None:
+            self.latencies.append(first_token_latency)
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    def record_failure(self, failure_threshold: int, cooldown: float):
+        """
+        Record a failed request and take the endpoint out of rotation
+        after too many consecutive failures.
+
+        Args:
+            failure_threshold: Consecutive failures before the endpoint is marked down
+            cooldown: Seconds the endpoint stays out of rotation
+        """
+        self.consecutive_failures += 1
+        self.total_failures += 1
+
+        if self.consecutive_failures >= failure_threshold:
+            self.down_until = time.monotonic() + cooldown
+            logger.warning(
+                f"Endpoint {self.url} marked down for {cooldown}s "
+                f"after {self.consecutive_failures} consecutive failures"
+            )
+
+    def latency_percentile(self, fraction: float) -> Optional[float]:
+        """
+        Get a first-token latency percentile over the recent window.
+
+        Args:
+            fraction: Percentile as a fraction (0.95 for p95)
+
+        Returns:
+            Latency in seconds, or None if there are no samples yet
+        """
+        return percentile(self.latencies, fraction)
+
+class EndpointPool:
+    """Weighted selection over healthy endpoints."""
+
+    # Minimum number of samples before the percentile is trusted for hedging
+    MIN_SAMPLES = 10
+
+    def __init__(
+        self,
+        urls: List[str],
+        weights: Optional[List[float]] = None,
+        failure_threshold: int = 3,
+        cooldown: float = 30
+    ):
+        if not urls:
+            raise ValueError("At least one endpoint URL is required")
+
+        weights = weights or []
+        self.endpoints = [
+            Endpoint(url, weights[i] if i < len(weights) else 1.0)
+            for i, url in enumerate(urls)
+        ]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    @classmethod
+    def from_config(cls, config: Config) -> "EndpointPool":
+        """Build the pool from bot configuration."""
+        return cls(
+            config.DEEPSEEK_URLS or [config.DEEPSEEK_URL],
+            config.DEEPSEEK_URL_WEIGHTS,
+            config.ENDPOINT_FAILURE_THRESHOLD,
+            config.ENDPOINT_COOLDOWN
+        )
+
+    def reconfigure(self, urls: List[str], weights: Optional[List[float]] = None):
+        """
+        Replace the endpoint list, keeping health and latency history of retained URLs.
+
+        Requests already in flight keep using the endpoints they picked.
+        """
+        if not urls:
+            raise ValueError("At least one endpoint URL is required")
+
+        weights = weights or []
+        existing = {e.url: e for e in self.endpoints}
+        endpoints = []
+        for i, url in enumerate(urls):
+            endpoint = existing.get(url) or Endpoint(url)
+            endpoint.weight = weights[i] if i < len(weights) else 1.0
+            endpoints.append(endpoint)
+        self.endpoints = endpoints
+        logger.info(f"Endpoint pool reconfigured: {', '.join(urls)}")
+
+    def choose(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """
+        Pick an endpoint for the next request.
+
+        Healthy endpoints are chosen at random proportionally to their weight,
+        scaled down by the number of requests already in flight. When every
+        candidate is down, the one that recovers soonest is used.
+
+        Args:
+            exclude: Endpoints already used by the current request
+
+        Returns:
+            Selected endpoint
+        """
+        excluded = set(id(endpoint) for endpoint in exclude)
+        candidates = [e for e in self.endpoints if id(e) not in excluded] or self.endpoints
+
+        now = time.monotonic()
+        healthy = [e for e in candidates if e.is_healthy(now) and e.weight > 0]
+        if not healthy:
+            return min(candidates, key=lambda e: e.down_until)
+
+        weights = [e.weight / (1 + e.in_flight) for e in healthy]
+        return random.choices(healthy, weights=weights)[0]
+
+    def has_alternative(self, exclude: Iterable[Endpoint] = ()) -> bool:
+        """
+        Check whether a healthy endpoint outside of exclude can take a request.
+
+        Args:
+            exclude: Endpoints already used by the current request
+        """
+        excluded = set(id(endpoint) for endpoint in exclude)
+        now = time.monotonic()
+        return any(
+            id(e) not in excluded and e.is_healthy(now) and e.weight > 0
+            for e in self.endpoints
+        )
+
+    def hedge_delay(
+        self,
+        endpoint: Endpoint,
+        fraction: float,
+        default: float,
+        minimum: float
+    ) -> float:
+        """
+        Get how long to wait for the first token before sending a backup request.
+
+        Args:
+            endpoint: Endpoint serving the primary request
+            fraction: Latency percentile used as the deadline
+            default: Deadline used until enough samples are collected
+            minimum: Lower bound for the deadline
+
+        Returns:
+            Deadline in seconds
+        """
+        if len(endpoint.latencies) < self.MIN_SAMPLES:
+            return max(default, minimum)
+        return max(endpoint.latency_percentile(fraction), minimum)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Get per-endpoint health and latency statistics."""
+        now = time.monotonic()
+        return [
+            {
+                "url": e.url,
+                "weight": e.weight,
+                "healthy": e.is_healthy(now),
+                "in_flight": e.in_flight,
+                "requests": e.total_requests,
+                "failures": e.total_failures,
+                "p50": e.latency_percentile(0.5),
+                "p95": e.latency_percentile(0.95)
+            }
+            for e in self.endpoints
+        ]
@@ -0,0 +1,132 @@
+"""
+Local stand-in for the DeepSeek chat completions API.
+
+Answers with canned text and can inject slowness and failures, which makes it
+possible to exercise hedging, failover and benchmarks without a real API key.
+
+Usage:
+    python fake_deepseek_server.py --port 8081 --delay 0.2 --slow-rate 0.1 --slow-delay 8
+    DEEPSEEK_URLS=http://127.0.0.1:8081/chat/completions,http://127.0.0.1:8082/chat/completions
+"""
+
+import json
+import random
+import asyncio
+import logging
+import argparse
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+class FakeDeepSeekServer:
+    """aiohttp application emulating the chat completions endpoint."""
+
+    def __init__(
+        self,
+        delay: float = 0.1,
+        slow_rate: float = 0.0,
+        slow_delay: float = 10.0,
+        error_rate: float = 0.0,
+        reply: str = "Ветер гонит пепел по пустой улице. Йонас слышит далёкий скрежет."
+    ):
+        self.delay = delay
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.error_rate = error_rate
+        self.reply = reply
+        self.requests = 0
+
+        self.app = web.Application()
+        self.app.router.add_post("/chat/completions", self.handle_completion)
+        self.app.router.add_post("/v1/chat/completions", self.handle_completion)
+
+    def _usage(self, messages) -> dict:
+        # Rough estimate: one token per four characters
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        completion_tokens = len(self.reply) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": prompt_tokens
+        }
+
+    async def handle_completion(self, request: web.Request) -> web.StreamResponse:
+        """Handle a chat completions request."""
+        self.requests += 1
+        payload = await request.json()
+        messages = payload.get("messages", [])
+
+        if random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "injected failure"}}, status=503)
+
+        delay = self.slow_delay if random.random() < self.slow_rate else self.delay
+        await asyncio.sleep(delay)
+
+        usage = self._usage(messages)
+
+        if not payload.get("stream"):
+            return web.json_response({
+                "id": f"fake-{self.requests}",
+                "object": "chat.completion",
+                "model": payload.get("model", "deepseek-chat"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        for word in self.reply.split(" "):
+            chunk = {
+                "id": f"fake-{self.requests}",
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": word + " "}}]
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        final_chunk = {"id": f"fake-{self.requests}", "choices": [], "usage": usage}
+        await response.write(f"data: {json.dumps(final_chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving in the current event loop.
+
+        Returns:
+            URL of the chat completions endpoint
+        """
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}/chat/completions"
+
+    async def stop(self):
+        """Stop serving."""
+        await self.runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake DeepSeek chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.1, help="Seconds before the first token")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests that stall")
+    parser.add_argument("--slow-delay", type=float, default=10.0, help="Delay of stalled requests")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeDeepSeekServer(args.delay, args.slow_rate, args.slow_delay, args.error_rate)
+    web.run_app(server.app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Event loop health monitoring and offloading of blocking work.
+
+A probe task measures how late the loop wakes up from a scheduled sleep (loop
+lag). A watchdog thread notices when the loop stops ticking for longer than
+the slow-callback threshold and logs the stack of the blocking code.
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+from config import Config
+from utils import percentile
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+def configure_blocking_pool(max_workers: int):
+    """Set the size of the pool used by run_blocking."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+
+async def run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run blocking file IO or CPU-heavy work in a thread pool.
+
+    Args:
+        func: Function to call
+        *args: Positional arguments for the function
+
+    Returns:
+        Result of the function
+    """
+    if _executor is None:
+        configure_blocking_pool(4)
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+class LoopMonitor:
+    """Measures event loop lag and reports callbacks that block the loop."""
+
+    def __init__(
+        self,
+        interval: float = 0.25,
+        slow_threshold: float = 0.2,
+        log_interval: float = 60,
+        window: int = 2000
+    ):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.log_interval = log_interval
+        self.lags: Deque[float] = deque(maxlen=window)
+        self.slow_callbacks = 0
+        self.last_slow_stack = ""
+        self.heartbeat = time.monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.probe_task: Optional[asyncio.Task] = None
+        self.watchdog_thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "LoopMonitor":
+        """Build the monitor from bot configuration."""
+        return cls(
+            config.LOOP_MONITOR_INTERVAL,
+            config.LOOP_SLOW_CALLBACK_THRESHOLD,
+            config.LOOP_MONITOR_LOG_INTERVAL
+        )
+
+    def start(self):
+        """Start the probe and the watchdog. Must be called from the running loop."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        # Used by asyncio itself when the loop runs in debug mode
+        self.loop.slow_callback_duration = self.slow_threshold
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+
+        self.probe_task = asyncio.ensure_future(self._probe())
+        self.watchdog_thread = threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True)
+        self.watchdog_thread.start()
+        logger.info(f"Event loop monitor started (interval {self.interval}s, slow threshold {self.slow_threshold}s)")
+
+    async def _probe(self):
+        last_log = time.monotonic()
+        while True:
+            scheduled = self.loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - scheduled - self.interval)
+            self.lags.append(lag)
+            self.heartbeat = time.monotonic()
+
+            if self.heartbeat - last_log >= self.log_interval:
+                last_log = self.heartbeat
+                stats = self.get_stats()
+                logger.info(
+                    f"Event loop lag: p50={stats['p50'] * 1000:.1f}ms "
+                    f"p95={stats['p95'] * 1000:.1f}ms p99={stats['p99'] * 1000:.1f}ms "
+                    f"max={stats['max'] * 1000:.1f}ms slow_callbacks={stats['slow_callbacks']}"
+                )
+
+    def _watchdog(self):
+        reported_heartbeat = None
+        while not self.stopped.wait(self.slow_threshold / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.slow_threshold or heartbeat == reported_heartbeat:
+                continue
+
+            # Report each stall once, with the stack of the code holding the loop
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<stack unavailable>"
+            self.slow_callbacks += 1
+            self.last_slow_stack = stack
+            logger.warning(f"Event loop blocked for more than {stalled:.3f}s:\n{stack}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get loop lag percentiles (seconds) and the number of detected stalls."""
+        lags = list(self.lags)
+        return {
+            "samples": len(lags),
+            "p50": percentile(lags, 0.5) or 0.0,
+            "p95": percentile(lags, 0.95) or 0.0,
+            "p99": percentile(lags, 0.99) or 0.0,
+            "max": max(lags, default=0.0),
+            "slow_callbacks": self.slow_callbacks
+        }
+
+    async def stop(self):
+        """Stop the probe and the watchdog."""
+        self.stopped.set()
+        if self.probe_task and not self.probe_task.done():
+            self.probe_task.cancel()
+            await asyncio.gather(self.probe_task, return_exceptions=True)
@@ -1,16 +1,60 @@
 import os
+import hashlib
+import asyncio
 import logging
-from typing import List, Optional
+from typing import List, Tuple
+from loop_monitor import run_blocking
 
 logger = logging.getLogger(__name__)
 
 class LoreManager:
     """Управление лором для ролевого бота"""
     
-    def __init__(self, lore_files: List[str] = None):
+    def __init__(self, lore_files: List[str] = None, lazy: bool = False):
         self.lore_files = lore_files or ["lore1.txt", "lore2.txt"]
         self.lore_content = ""
-        self.load_lore()
+        # Версия лора (хеш содержимого) для учета расходов по кампаниям
+        self.version = ""
+        # Индекс для поиска: пары (строка в нижнем регистре, исходная строка)
+        self.search_index: List[Tuple[str, str]] = []
+        self.ready = asyncio.Event()
+        
+        # В ленивом режиме лор загружается позже через load_lore_async
+        if not lazy:
+            self.load_lore()
+            self.ready.set()
+    
+    def is_ready(self) -> bool:
+        """Загружен ли лор"""
+        return self.ready.is_set()
+    
+    async def load_lore_async(self):
+        """Загрузить лор в пуле потоков и отметить его готовность"""
+        try:
+            await run_blocking(self.load_lore)
+        except Exception as e:
+            # Без этого сообщения ждали бы лор до таймаута, а ошибка осталась бы незамеченной
+            logger.error(f"Ошибка загрузки лора, бот работает без лора: {e}")
+        finally:
+            self.ready.set()
+    
+    async def wait_ready(self, timeout: float) -> bool:
+        """Дождаться загрузки лора не дольше timeout секунд"""
+        if self.ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def _build_index(self):
+        """Построить индекс строк лора для поиска"""
+        self.search_index = [(line.lower(), line.strip()) for line in self.lore_content.split('\n')]
+    
+    def _update_version(self):
+        """Вычислить версию лора по его содержимому"""
+        self.version = hashlib.sha1(self.lore_content.encode('utf-8')).hexdigest()[:12] if self.lore_content else ""
     
     def load_lore(self):
         """Загрузить лор из файлов"""
@@ -31,6 +75,8 @@ class LoreManager:
         
         if combined_lore:
             self.lore_content = "\n\n".join(combined_lore)
+            self._build_index()
+            self._update_version()
             logger.info(f"Общий размер лора: {len(self.lore_content)} символов")
         else:
             logger.warning("Лор не загружен - файлы пусты или отсутствуют")
@@ -75,16 +121,20 @@ class LoreManager:
         
         # Простой поиск по ключевым словам
         query_words = query.lower().split()
-        lines = self.lore_content.split('\n')
         relevant_lines = []
         
-        for line in lines:
-            line_lower = line.lower()
+        for line_lower, line in self.search_index:
             if any(word in line_lower for word in query_words):
-                relevant_lines.append(line.strip())
+                relevant_lines.append(line)
+                if len(relevant_lines) == 10:
+                    break
         
-        return relevant_lines[:10]  # Возвращаем максимум 10 релевантных строк
+        return relevant_lines  # Возвращаем максимум 10 релевантных строк
     
     def reload_lore(self):
         """Перезагрузить лор из файлов"""
-        self.load_lore()
\ No newline at end of file
+        self.load_lore()
+    
+    async def reload_lore_async(self):
+        """Перезагрузить лор в пуле потоков, не блокируя цикл событий"""
+        await run_blocking(self.reload_lore)
@@ -1,6 +1,5 @@
 import logging
 import asyncio
-from bot import TelegramBot
 from config import Config
 
 # Configure logging
@@ -25,6 +24,9 @@ async def main():
             logger.error("DEEPSEEK_API_KEY environment variable is required")
             return
         
+        # Import the python-telegram-bot stack only after the configuration is valid
+        from bot import TelegramBot
+        
         # Initialize and start the bot
         bot = TelegramBot(config)
         logger.info("Starting Telegram bot...")
@@ -41,8 +43,7 @@ if __name__ == "__main__":
     import nest_asyncio
 
     async def main_wrapper():
-        bot = TelegramBot(Config())
-        await bot.start()
+        await main()
 
     try:
         asyncio.run(main_wrapper())
@@ -0,0 +1,155 @@
+"""
+Speculative pre-warming of the next turn's prompt.
+
+Right after a reply is sent, the prompt the session's next turn will start
+with (system prompt with lore and world state, plus the history) is built
+and encoded in the background. When the next message arrives and the prefix
+still matches, only the new user message has to be encoded. A prepared prompt
+with the full lore weighs a few hundred kilobytes, so only the most recently
+active sessions keep one.
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from deepseek_client import encode_messages
+from utils import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+PromptBuilder = Callable[[], Awaitable[Tuple[str, List[Dict[str, str]]]]]
+
+def digest(text: str) -> Tuple[int, int]:
+    """
+    Get a length and hash identifying a prompt within this process.
+
+    The built-in string hash avoids encoding the prompt, which would cost
+    about as much as the encoding the prepared prefix saves.
+    """
+    return len(text), hash(text)
+
+class PreparedPrompt:
+    """Encoded prompt prefix of a session's next turn."""
+
+    def __init__(self, system_prompt: str, messages: List[Dict[str, str]], prefix: bytes, build_time: float):
+        # A digest instead of the prompt itself: the encoded prefix already holds a copy of it
+        self.system_prompt_digest = digest(system_prompt)
+        self.messages = messages
+        self.prefix = prefix
+        self.build_time = build_time
+        self.token_estimate = (len(system_prompt) + sum(len(m["content"]) for m in messages)) // CHARS_PER_TOKEN
+
+    def matches(self, system_prompt: str, messages: List[Dict[str, str]]) -> bool:
+        """Check whether the prefix is still valid for the actual turn."""
+        return self.messages == messages and self.system_prompt_digest == digest(system_prompt)
+
+class PromptPrewarmer:
+    """Builds prompt prefixes ahead of time and serves them on the hot path."""
+
+    def __init__(self, enabled: bool = True, max_sessions: int = 100):
+        """
+        Args:
+            enabled: Whether prompts are prepared at all
+            max_sessions: Prepared prompts kept, the least recently active sessions are dropped first
+        """
+        self.enabled = enabled
+        self.max_sessions = max_sessions
+        self.prepared: "OrderedDict[Any, PreparedPrompt]" = OrderedDict()
+        self.tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+        self.last_saved_time = 0.0
+
+    @staticmethod
+    def _encode(system_prompt: str, messages: List[Dict[str, str]]) -> bytes:
+        # Encoding holds the GIL, so a worker thread would stall the loop just the same
+        return encode_messages([{"role": "system", "content": system_prompt}] + messages)
+
+    async def get_prefix(self, session_id, system_prompt: str, messages: List[Dict[str, str]]) -> bytes:
+        """
+        Get the encoded prefix for a turn, from the prepared prompt if it matches.
+
+        Args:
+            session_id: Session key (user or chat ID)
+            system_prompt: Actual system prompt of the turn
+            messages: Actual history before the new user message
+
+        Returns:
+            Messages encoded with encode_messages, system prompt first
+        """
+        started = time.perf_counter()
+        prepared = self.prepared.pop(session_id, None)
+
+        if prepared is not None and prepared.matches(system_prompt, messages):
+            hot_time = time.perf_counter() - started
+            self.hits += 1
+            self.last_saved_time = max(0.0, prepared.build_time - hot_time)
+            self.saved_time += self.last_saved_time
+            logger.debug(
+                f"Prepared prompt hit for session {session_id}: saved "
+                f"{self.last_saved_time * 1000:.2f}ms, ~{prepared.token_estimate} tokens"
+            )
+            return prepared.prefix
+
+        if prepared is not None:
+            self.misses += 1
+            logger.debug(f"Prepared prompt for session {session_id} is stale")
+
+        return self._encode(system_prompt, messages)
+
+    def schedule(self, session_id, build: PromptBuilder):
+        """
+        Prepare the next turn's prefix in the background.
+
+        Args:
+            session_id: Session key (user or chat ID)
+            build: Coroutine function returning the system prompt and history
+                the next turn is expected to start with
+        """
+        if not self.enabled:
+            return
+
+        task = asyncio.ensure_future(self._prepare(session_id, build))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _prepare(self, session_id, build: PromptBuilder):
+        try:
+            system_prompt, messages = await build()
+            started = time.perf_counter()
+            prefix = self._encode(system_prompt, messages)
+            self.prepared[session_id] = PreparedPrompt(
+                system_prompt, messages, prefix, time.perf_counter() - started
+            )
+            self.prepared.move_to_end(session_id)
+            while len(self.prepared) > self.max_sessions:
+                dropped, _ = self.prepared.popitem(last=False)
+                logger.debug(f"Dropped prepared prompt of inactive session {dropped}")
+        except Exception as e:
+            logger.warning(f"Failed to prepare prompt for session {session_id}: {e}")
+
+    def discard(self, session_id):
+        """Forget the prepared prompt of a session."""
+        self.prepared.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit counts and the prompt build time saved per turn."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "prepared": len(self.prepared),
+            "saved_ms_total": self.saved_time * 1000,
+            "saved_ms_per_hit": self.saved_time * 1000 / self.hits if self.hits else 0.0,
+            "saved_ms_last": self.last_saved_time * 1000
+        }
+
+    async def close(self):
+        """Cancel pending preparations."""
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
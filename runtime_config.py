@@ -0,0 +1,282 @@
+"""
+Hot-reloadable runtime configuration.
+
+A JSON file overrides the tunable subset of Config without a restart. The
+file is polled for changes; a new version is validated as a whole and then
+applied to the shared Config object in one synchronous step, so no coroutine
+ever sees half of an update. Components that cache settings at construction
+are notified with the names of the changed settings. Settings missing from
+the file fall back to their environment values, and an invalid file keeps
+the previous settings active.
+"""
+
+import os
+import json
+import time
+import copy
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from config import Config
+from loop_monitor import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Setting name -> (type, minimum value for numbers, element type for lists)
+RELOADABLE: Dict[str, Tuple[type, Optional[float], Optional[type]]] = {
+    # Model routing
+    "DEEPSEEK_MODEL": (str, None, None),
+    "DEEPSEEK_URLS": (list, None, str),
+    "DEEPSEEK_URL_WEIGHTS": (list, 0, float),
+    "HEDGE_ENABLED": (bool, None, None),
+    "HEDGE_PERCENTILE": (float, 0, None),
+    "HEDGE_DEFAULT_DELAY": (float, 0, None),
+    "HEDGE_MIN_DELAY": (float, 0, None),
+    "MAX_UPSTREAM_ATTEMPTS": (int, 1, None),
+    "ENDPOINT_FAILURE_THRESHOLD": (int, 1, None),
+    "ENDPOINT_COOLDOWN": (int, 0, None),
+    "UPSTREAM_RETRY_BACKOFF": (float, 0, None),
+    # Prompt and history budgets
+    "SYSTEM_PROMPT": (str, None, None),
+    "MAX_HISTORY_LENGTH": (int, 2, None),
+    "WORLD_STATE_HISTORY_LENGTH": (int, 2, None),
+    "PROMPT_PREWARM_ENABLED": (bool, None, None),
+    "PROMPT_PREWARM_MAX_SESSIONS": (int, 1, None),
+    # Timeouts
+    "REQUEST_TIMEOUT": (int, 1, None),
+    "LORE_READY_TIMEOUT": (float, 0, None),
+    # Rate limits and concurrency
+    "USER_DAILY_TOKEN_QUOTA": (int, 0, None),
+    "CHAT_DAILY_TOKEN_QUOTA": (int, 0, None),
+    "SCENE_ROUND_WINDOW": (float, 0, None),
+    "SCENE_MAX_ROUND_ACTIONS": (int, 1, None),
+    "SCENE_MAX_CONCURRENT_ROUNDS": (int, 1, None),
+    # Cost estimates
+    "PRICE_INPUT_CACHE_HIT": (float, 0, None),
+    "PRICE_INPUT_CACHE_MISS": (float, 0, None),
+    "PRICE_OUTPUT": (float, 0, None),
+    # Administration
+    "ADMIN_USER_IDS": (list, None, int),
+}
+
+class ConfigError(ValueError):
+    """Invalid runtime configuration file."""
+
+def _check_value(name: str, value: Any, expected: type, minimum: Optional[float]) -> Any:
+    # bool is a subclass of int, so it is rejected explicitly for numbers
+    if expected is bool:
+        if not isinstance(value, bool):
+            raise ConfigError(f"{name}: expected true or false")
+        return value
+
+    if expected in (int, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ConfigError(f"{name}: expected a number")
+        if expected is int and value != int(value):
+            raise ConfigError(f"{name}: expected an integer")
+        value = expected(value)
+        if minimum is not None and value < minimum:
+            raise ConfigError(f"{name}: must be at least {minimum:g}")
+        return value
+
+    if not isinstance(value, expected):
+        raise ConfigError(f"{name}: expected {expected.__name__}")
+    return value
+
+def validate_settings(data: Any) -> Dict[str, Any]:
+    """
+    Validate the contents of a runtime configuration file.
+
+    Args:
+        data: Parsed JSON document
+
+    Returns:
+        Typed settings by Config attribute name
+
+    Raises:
+        ConfigError: Listing every problem found in the document
+    """
+    if not isinstance(data, dict):
+        raise ConfigError("expected a JSON object with settings")
+
+    settings = {}
+    errors = []
+
+    for name, value in data.items():
+        if name not in RELOADABLE:
+            errors.append(f"{name}: unknown or not reloadable setting")
+            continue
+
+        expected, minimum, element = RELOADABLE[name]
+        try:
+            if expected is list:
+                if not isinstance(value, list):
+                    raise ConfigError(f"{name}: expected a list")
+                value = [_check_value(f"{name}[{i}]", item, element, minimum) for i, item in enumerate(value)]
+            else:
+                value = _check_value(name, value, expected, minimum)
+        except ConfigError as e:
+            errors.append(str(e))
+            continue
+
+        settings[name] = value
+
+    if "DEEPSEEK_URLS" in settings and not settings["DEEPSEEK_URLS"]:
+        errors.append("DEEPSEEK_URLS: at least one endpoint URL is required")
+    if "HEDGE_PERCENTILE" in settings and settings["HEDGE_PERCENTILE"] > 1:
+        errors.append("HEDGE_PERCENTILE: must be a fraction between 0 and 1")
+
+    if errors:
+        raise ConfigError("; ".join(errors))
+    return settings
+
+ConfigListener = Callable[[Set[str]], Any]
+
+class ConfigWatcher:
+    """Polls a JSON file and applies its settings to a live Config."""
+
+    def __init__(self, config: Config, path: str, interval: float = 5):
+        """
+        Args:
+            config: Configuration shared by the running components
+            path: JSON file with setting overrides
+            interval: Seconds between checks for changes
+        """
+        self.config = config
+        self.path = path
+        self.interval = interval
+        # Values from the environment, restored when a setting leaves the file
+        self.defaults = {name: copy.deepcopy(getattr(config, name)) for name in RELOADABLE}
+        self.overrides: Dict[str, Any] = {}
+        self.listeners: List[ConfigListener] = []
+        self.stamp: Optional[Tuple[float, int]] = None
+        self.version = 0
+        self.loaded_at: Optional[float] = None
+        self.last_error = ""
+        self.task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ConfigWatcher":
+        """Build the watcher from bot configuration."""
+        return cls(config, config.CONFIG_FILE, config.CONFIG_RELOAD_INTERVAL)
+
+    def add_listener(self, listener: ConfigListener):
+        """Register a callback receiving the names of changed settings."""
+        self.listeners.append(listener)
+
+    def _stat(self) -> Optional[Tuple[float, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except ValueError as e:
+            raise ConfigError(f"invalid JSON: {e}")
+        settings = validate_settings(data)
+        self._check_weights(settings)
+        return settings
+
+    def _check_weights(self, overrides: Dict[str, Any]):
+        """Check the endpoint weights against the URLs they will be used with."""
+        values = dict(self.defaults, **overrides)
+        urls = values["DEEPSEEK_URLS"] or [self.config.DEEPSEEK_URL]
+        weights = values["DEEPSEEK_URL_WEIGHTS"]
+        # Without weights every endpoint gets 1; a partial list would silently do the same for the rest
+        if weights and len(weights) != len(urls):
+            raise ConfigError(
+                f"DEEPSEEK_URL_WEIGHTS: {len(weights)} weights for {len(urls)} endpoint URLs"
+            )
+
+    def _check(self) -> Optional[Dict[str, Any]]:
+        """Read and validate the file if it changed since the last check."""
+        stamp = self._stat()
+        if stamp == self.stamp:
+            return None
+        self.stamp = stamp
+
+        if stamp is None:
+            # A removed file keeps the last settings rather than silently reverting them
+            logger.warning(f"Runtime config {self.path} not found, keeping the active settings")
+            return None
+
+        try:
+            return self._read()
+        except (OSError, ConfigError) as e:
+            self.last_error = str(e)
+            logger.error(f"Runtime config {self.path} rejected, keeping the active settings: {e}")
+            return None
+
+    def load(self) -> Set[str]:
+        """
+        Read the file if it changed and apply its settings.
+
+        Returns:
+            Names of the settings whose active values changed
+        """
+        overrides = self._check()
+        return self.apply(overrides) if overrides is not None else set()
+
+    def apply(self, overrides: Dict[str, Any]) -> Set[str]:
+        """
+        Swap in a validated set of overrides and notify the listeners.
+
+        Args:
+            overrides: Settings returned by validate_settings
+
+        Returns:
+            Names of the settings whose active values changed
+        """
+        values = dict(self.defaults, **overrides)
+        changed = {name for name, value in values.items() if getattr(self.config, name) != value}
+
+        # No awaits between the assignments: coroutines see either the old or the new settings
+        for name in changed:
+            setattr(self.config, name, copy.deepcopy(values[name]))
+
+        self.overrides = overrides
+        self.version += 1
+        self.loaded_at = time.time()
+        self.last_error = ""
+
+        if changed:
+            logger.info(f"Runtime config {self.path} applied, changed: {', '.join(sorted(changed))}")
+            for listener in self.listeners:
+                try:
+                    listener(changed)
+                except Exception as e:
+                    logger.error(f"Failed to apply runtime config change: {e}")
+
+        return changed
+
+    def start(self):
+        """Start watching the file (call from a running event loop)."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            overrides = await run_blocking(self._check)
+            if overrides is not None:
+                self.apply(overrides)
+
+    def get_active(self) -> List[Tuple[str, Any, bool]]:
+        """
+        Get the active values of the reloadable settings.
+
+        Returns:
+            List of (name, value, overridden by the file)
+        """
+        return [(name, getattr(self.config, name), name in self.overrides) for name in RELOADABLE]
+
+    async def stop(self):
+        """Stop watching the file."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
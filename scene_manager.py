@@ -0,0 +1,227 @@
+"""
+Group-chat scenes with shared history and batched turns.
+
+In a group chat all players share one story keyed by chat ID. Their actions
+are collected into rounds, and each round is narrated by a single upstream
+request, so a busy group costs one request per round instead of one per
+message.
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCENE_PROMPT = """Это общая сцена в групповом чате: в ней участвуют несколько игроков.
+Каждое сообщение игроков содержит действия всех участников за один раунд в формате [Имя]: действие.
+Опиши в одном ответе, что происходит в результате действий каждого из них, уделив внимание всем игрокам."""
+
+# An action is (user_id, player name, text, ID of the Telegram update that carried it)
+Action = Tuple[int, str, str, Optional[int]]
+
+class Scene:
+    """Shared state of a group-chat scene."""
+
+    # Players who acted within this many rounds are expected to act in the next one
+    ACTIVE_ROUNDS = 3
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.history: List[Dict[str, str]] = []
+        self.round_number = 0
+        self.pending: "OrderedDict[int, Action]" = OrderedDict()
+        self.backlog: Deque[Action] = deque()
+        # Actions of the round being narrated
+        self.resolving: List[Action] = []
+        self.last_acted: Dict[int, int] = {}
+        self.round_task: asyncio.Task = None
+        self.round_full = asyncio.Event()
+        self.created_at = time.time()
+
+    def active_players(self) -> Set[int]:
+        """Players who acted recently."""
+        return {
+            user_id for user_id, round_number in self.last_acted.items()
+            if self.round_number - round_number < self.ACTIVE_ROUNDS
+        }
+
+    def add_action(self, action: Action, max_actions: int) -> bool:
+        """
+        Add a player's action to the current round.
+
+        A player gets one action per round; further messages wait in the
+        backlog for the following rounds. While a player has messages in the
+        backlog, new ones queue up behind them so their order is kept.
+
+        Returns:
+            True if the action joined the current round, False if it was queued
+        """
+        user_id = action[0]
+        if (
+            user_id in self.pending
+            or len(self.pending) >= max_actions
+            or any(queued[0] == user_id for queued in self.backlog)
+        ):
+            self.backlog.append(action)
+            return False
+
+        self.pending[user_id] = action
+        self._check_full(max_actions)
+        return True
+
+    def _check_full(self, max_actions: int):
+        # Close the round early once every recently active player has acted
+        active = self.active_players()
+        if len(self.pending) >= max_actions or (active and active <= set(self.pending)):
+            self.round_full.set()
+
+    def take_round(self) -> List[Action]:
+        """
+        Close the current round and return its actions.
+
+        Players who waited longest since their previous action go first.
+        """
+        actions = sorted(
+            self.pending.values(),
+            key=lambda action: self.last_acted.get(action[0], -1)
+        )
+        self.round_number += 1
+        for user_id, *_ in actions:
+            self.last_acted[user_id] = self.round_number
+
+        self.pending = OrderedDict()
+        self.round_full = asyncio.Event()
+        return actions
+
+    def refill_from_backlog(self, max_actions: int):
+        """Move queued actions into the new round, at most one per player."""
+        deferred: Deque[Action] = deque()
+        while self.backlog:
+            action = self.backlog.popleft()
+            if action[0] in self.pending or len(self.pending) >= max_actions:
+                deferred.append(action)
+            else:
+                self.pending[action[0]] = action
+        self.backlog = deferred
+        self._check_full(max_actions)
+
+    def get_actions(self) -> List[Action]:
+        """All actions not narrated yet, including the round in progress."""
+        return self.resolving + list(self.pending.values()) + list(self.backlog)
+
+    def add_message(self, role: str, content: str, max_length: int):
+        """Append a message to the shared history, trimming it to max_length."""
+        self.history.append({"role": role, "content": content})
+        if len(self.history) > max_length:
+            self.history = self.history[-max_length:]
+
+def format_round(actions: List[Action]) -> str:
+    """Combine the actions of a round into one user message."""
+    return "\n".join(f"[{name}]: {text}" for _, name, text, _ in actions)
+
+class SceneManager:
+    """Collects actions in group chats and resolves them round by round."""
+
+    def __init__(
+        self,
+        config: Config,
+        resolve_round: Callable[[Scene, List[Action]], Awaitable[Any]]
+    ):
+        """
+        Args:
+            config: Bot configuration
+            resolve_round: Coroutine narrating a closed round of a scene
+        """
+        self.config = config
+        self.resolve_round = resolve_round
+        self.scenes: Dict[int, Scene] = {}
+        self.semaphore = asyncio.Semaphore(config.SCENE_MAX_CONCURRENT_ROUNDS)
+
+    def apply_config(self):
+        """Pick up a reloaded round concurrency limit."""
+        # Rounds already running release the old semaphore; new rounds use the new limit
+        self.semaphore = asyncio.Semaphore(self.config.SCENE_MAX_CONCURRENT_ROUNDS)
+
+    def get_scene(self, chat_id: int) -> Scene:
+        """Get the scene of a chat, creating it if needed."""
+        if chat_id not in self.scenes:
+            self.scenes[chat_id] = Scene(chat_id)
+            logger.info(f"Started scene in chat {chat_id}")
+        return self.scenes[chat_id]
+
+    def submit(self, chat_id: int, user_id: int, name: str, text: str, update_id: Optional[int] = None) -> bool:
+        """
+        Submit a player's action.
+
+        Args:
+            chat_id: Group chat ID
+            user_id: Telegram user ID
+            name: Player's display name
+            text: Action text
+            update_id: Telegram update carrying the action, passed on to resolve_round
+
+        Returns:
+            True if the action joined the current round, False if it was queued
+        """
+        scene = self.get_scene(chat_id)
+        accepted = scene.add_action((user_id, name, text, update_id), self.config.SCENE_MAX_ROUND_ACTIONS)
+
+        if scene.round_task is None or scene.round_task.done():
+            scene.round_task = asyncio.ensure_future(self._run_rounds(scene))
+
+        logger.debug(f"Action from user {user_id} in chat {chat_id} {'accepted' if accepted else 'queued'}")
+        return accepted
+
+    async def _run_rounds(self, scene: Scene):
+        """Resolve rounds of a scene until no actions are left."""
+        while scene.pending:
+            try:
+                await asyncio.wait_for(scene.round_full.wait(), timeout=self.config.SCENE_ROUND_WINDOW)
+            except asyncio.TimeoutError:
+                pass
+
+            actions = scene.take_round()
+            scene.resolving = actions
+            logger.info(f"Resolving round {scene.round_number} in chat {scene.chat_id} with {len(actions)} actions")
+
+            async with self.semaphore:
+                try:
+                    await self.resolve_round(scene, actions)
+                except Exception as e:
+                    logger.error(f"Error resolving round in chat {scene.chat_id}: {e}")
+                finally:
+                    scene.resolving = []
+
+            scene.refill_from_backlog(self.config.SCENE_MAX_ROUND_ACTIONS)
+
+    def reset(self, chat_id: int) -> List[Action]:
+        """
+        Drop the scene of a chat.
+
+        Returns:
+            Actions that were dropped without being narrated
+        """
+        scene = self.scenes.pop(chat_id, None)
+        if not scene:
+            return []
+        dropped = scene.get_actions()
+        if scene.round_task and not scene.round_task.done():
+            scene.round_task.cancel()
+        logger.info(f"Reset scene in chat {chat_id}")
+        return dropped
+
+    def get_active_scenes_count(self) -> int:
+        """Get the number of scenes."""
+        return len(self.scenes)
+
+    async def close(self):
+        """Cancel running rounds."""
+        tasks = [s.round_task for s in self.scenes.values() if s.round_task and not s.round_task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,30 +1,83 @@
-import os
+import time
 import asyncio
 import aiohttp
 import json
+import html
 import logging
+import contextvars
+from config import Config
+from deepseek_client import DeepSeekClient
 from lore_manager import LoreManager
-
-# Настройки
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_URL = "https://api.deepseek.com/chat/completions"
+from utils import format_error_message, stable_window
+from world_state import WorldStateManager
+from scene_manager import SCENE_PROMPT, SceneManager, format_round
+from loop_monitor import LoopMonitor, configure_blocking_pool
+from update_queue import UpdateQueue
+from usage_tracker import UsageTracker
+from prompt_cache import PromptPrewarmer
+from runtime_config import ConfigWatcher
 
 # Хранилище истории диалога
 conversations = {}
 
-SYSTEM_PROMPT = "Ты — ролевой персонаж. Общайся дружелюбно и интересно."
+# Обновление, которое сейчас обрабатывается; ответы привязываются к нему в очереди
+current_update_id = contextvars.ContextVar("current_update_id", default=None)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class TelegramAPIError(Exception):
+    """Telegram не принял запрос (ok: false, например 429 при flood control)"""
+    
+    def __init__(self, message, error_code=None):
+        super().__init__(message)
+        self.error_code = error_code
+    
+    @property
+    def retryable(self):
+        """Повтор имеет смысл только при flood control и ошибках сервера"""
+        return self.error_code is None or self.error_code == 429 or self.error_code >= 500
+
 class TelegramBot:
-    def __init__(self, token):
+    def __init__(self, token, config=None):
         self.token = token
-        self.api_url = f"https://api.telegram.org/bot{token}"
+        self.config = config or Config()
+        # Настройки из файла применяются до создания компонентов и затем перечитываются на лету
+        self.config_watcher = ConfigWatcher.from_config(self.config) if self.config.CONFIG_FILE else None
+        if self.config_watcher:
+            self.config_watcher.load()
+            self.config_watcher.add_listener(self.apply_config)
+        self.api_url = f"{self.config.TELEGRAM_API_URL}/bot{token}"
         self.session = None
-        self.lore_manager = LoreManager()
+        # Лор загружается в фоне после запуска, чтобы сразу начать принимать обновления
+        self.lore_manager = LoreManager(lazy=True)
+        self.lore_task = None
+        self.update_queue = UpdateQueue(self.config.QUEUE_DB_PATH) if self.config.QUEUE_DB_PATH else None
+        configure_blocking_pool(self.config.BLOCKING_POOL_WORKERS)
+        self.loop_monitor = LoopMonitor.from_config(self.config) if self.config.LOOP_MONITOR_ENABLED else None
+        self.deepseek_client = DeepSeekClient(self.config)
+        self.usage_tracker = UsageTracker.from_config(self.config) if self.config.USAGE_DB_PATH else None
+        self.deepseek_client.usage_tracker = self.usage_tracker
+        self.prompt_prewarmer = PromptPrewarmer(
+            self.config.PROMPT_PREWARM_ENABLED, self.config.PROMPT_PREWARM_MAX_SESSIONS
+        )
+        self.world_state_manager = (
+            WorldStateManager(self.deepseek_client) if self.config.WORLD_STATE_ENABLED else None
+        )
+        self.scene_manager = (
+            SceneManager(self.config, self.resolve_scene_round) if self.config.SCENE_MODE_ENABLED else None
+        )
+        
+    def apply_config(self, changed):
+        """Применить перечитанные настройки в работающих компонентах"""
+        self.deepseek_client.apply_config(changed)
+        self.prompt_prewarmer.enabled = self.config.PROMPT_PREWARM_ENABLED
+        self.prompt_prewarmer.max_sessions = self.config.PROMPT_PREWARM_MAX_SESSIONS
+        if self.usage_tracker:
+            self.usage_tracker.apply_config(self.config)
+        if self.scene_manager and "SCENE_MAX_CONCURRENT_ROUNDS" in changed:
+            self.scene_manager.apply_config()
         
     async def get_session(self):
         if self.session is None or self.session.closed:
@@ -32,11 +85,53 @@ class TelegramBot:
         return self.session
         
     async def close(self):
+        if self.lore_task and not self.lore_task.done():
+            self.lore_task.cancel()
+        if self.loop_monitor:
+            await self.loop_monitor.stop()
+        if self.config_watcher:
+            await self.config_watcher.stop()
         if self.session and not self.session.closed:
             await self.session.close()
+        if self.scene_manager:
+            await self.scene_manager.close()
+        if self.world_state_manager:
+            await self.world_state_manager.close()
+        await self.prompt_prewarmer.close()
+        await self.deepseek_client.close()
+        if self.usage_tracker:
+            await self.usage_tracker.close()
+        if self.update_queue:
+            await self.update_queue.close()
             
-    async def send_message(self, chat_id, text):
-        """Отправить сообщение через Telegram API"""
+    async def send_message(self, chat_id, text, update_ids=None):
+        """Отправить сообщение через Telegram API; update_ids - обновления, на которые это ответ"""
+        # Сохранить ответ до отправки, чтобы после сбоя отправить его повторно
+        if update_ids is None:
+            update_ids = [current_update_id.get()]
+        update_ids = [update_id for update_id in update_ids if update_id is not None]
+        reply_id = None
+        if self.update_queue and update_ids:
+            reply_id = await self.update_queue.add_reply(update_ids[0], chat_id, text, update_ids[1:])
+        
+        try:
+            result = await self.post_message(chat_id, text)
+        except TelegramAPIError as e:
+            if e.retryable:
+                raise
+            # Telegram не примет этот ответ никогда (ошибка разметки, бот заблокирован): не повторять
+            logger.error(f"Ответ в чат {chat_id} отклонен без повтора: {e}")
+            if reply_id is not None:
+                await self.update_queue.mark_failed(reply_id)
+            return None
+        
+        # Отправленным ответ считается только после подтверждения Telegram
+        if reply_id is not None:
+            await self.update_queue.mark_sent(reply_id)
+        return result
+        
+    async def post_message(self, chat_id, text):
+        """Отправить сообщение через Telegram API без записи в очередь; при отказе бросает исключение"""
         session = await self.get_session()
         url = f"{self.api_url}/sendMessage"
         data = {
@@ -49,6 +144,23 @@ class TelegramBot:
             result = await response.json()
             if not result.get("ok"):
                 logger.error(f"Ошибка отправки сообщения: {result}")
+                raise TelegramAPIError(
+                    f"sendMessage: {result.get('error_code')} {result.get('description')}",
+                    result.get("error_code") or response.status
+                )
+            return result
+            
+    async def send_document(self, chat_id, filename, content):
+        """Отправить файл через Telegram API"""
+        session = await self.get_session()
+        form = aiohttp.FormData()
+        form.add_field("chat_id", str(chat_id))
+        form.add_field("document", content, filename=filename)
+        
+        async with session.post(f"{self.api_url}/sendDocument", data=form) as response:
+            result = await response.json()
+            if not result.get("ok"):
+                logger.error(f"Ошибка отправки файла: {result}")
             return result
             
     async def get_updates(self, offset=None):
@@ -62,48 +174,171 @@ class TelegramBot:
         async with session.get(url, params=params) as response:
             return await response.json()
             
-    async def get_deepseek_response(self, conversation_history):
+    def build_prompt(self, session_id, base_prompt, history):
+        """Собрать системный промпт и историю для запроса"""
+        # Создаем системный промпт с лором
+        system_prompt = self.lore_manager.get_system_prompt(base_prompt)
+        
+        # Состояние мира заменяет большую часть сырой истории
+        world_block = self.world_state_manager.get_prompt_block(session_id) if self.world_state_manager else ""
+        if world_block:
+            system_prompt = f"{system_prompt}\n{world_block}\n"
+            # Окно сдвигается блоками, чтобы префикс промпта не менялся каждый ход
+            history = stable_window(history, self.config.WORLD_STATE_HISTORY_LENGTH)
+        
+        return system_prompt, history
+        
+    async def get_deepseek_response(self, conversation_history, session_id=None, base_prompt=None, usage_tags=None):
         """Получить ответ от DeepSeek API"""
-        session = await self.get_session()
+        # Пока лор грузится, ждем его ограниченное время, затем отвечаем без лора
+        if not await self.lore_manager.wait_ready(self.config.LORE_READY_TIMEOUT):
+            logger.warning("Лор еще не загружен, ответ будет без лора")
         
-        # Создаем системный промпт с лором
-        system_prompt = self.lore_manager.get_system_prompt(SYSTEM_PROMPT)
-        messages = [{"role": "system", "content": system_prompt}] + conversation_history
-        
-        payload = {
-            "model": "deepseek-chat",
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 2000
-        }
+        system_prompt, conversation_history = self.build_prompt(
+            session_id, base_prompt or self.config.SYSTEM_PROMPT, conversation_history
+        )
         
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
+        # Учет расходов по пользователю, чату и версии лора
+        usage_tags = dict(usage_tags or {}, lore_version=self.lore_manager.version)
         
         try:
-            async with session.post(DEEPSEEK_URL, json=payload, headers=headers, timeout=30) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data["choices"][0]["message"]["content"]
-                else:
-                    error_text = await response.text()
-                    logger.error(f"DeepSeek API error {response.status}: {error_text}")
-                    return "Извините, произошла ошибка при обращении к AI. Попробуйте позже."
-                    
-        except asyncio.TimeoutError:
-            logger.error("DeepSeek API timeout")
-            return "Извините, превышено время ожидания ответа. Попробуйте позже."
+            # Префикс промпта обычно подготовлен заранее; кодируется только новое сообщение
+            prefix = await self.prompt_prewarmer.get_prefix(session_id, system_prompt, conversation_history[:-1])
+            response = await self.deepseek_client.get_response(
+                conversation_history[-1:], usage_tags=usage_tags, encoded_prefix=prefix
+            )
         except Exception as e:
             logger.error(f"DeepSeek API error: {e}")
-            return "Извините, произошла ошибка при обращении к AI. Попробуйте позже."
+            return f"Извините, произошла ошибка при обращении к AI. {format_error_message(e)}"
+        
+        # Обновить состояние мира в фоне, не задерживая ответ
+        if self.world_state_manager and session_id is not None:
+            self.world_state_manager.schedule_update(
+                session_id, conversation_history[-1]["content"], response, usage_tags
+            )
+        
+        return response
+        
+    def schedule_prewarm(self, session_id, history, history_limit, base_prompt=None):
+        """Подготовить промпт следующего хода, пока игрок пишет"""
+        if not self.lore_manager.is_ready():
+            return
+        
+        # Следующий ход добавит сообщение игрока и обрежет историю так же, как при обработке
+        next_history = (list(history) + [{"role": "user", "content": ""}])[-history_limit:]
+        base_prompt = base_prompt or self.config.SYSTEM_PROMPT
+        
+        async def build():
+            # Дождаться обновления состояния мира, которое войдет в промпт
+            if self.world_state_manager:
+                await self.world_state_manager.wait_idle(session_id)
+            system_prompt, messages = self.build_prompt(session_id, base_prompt, next_history)
+            return system_prompt, messages[:-1]
+        
+        self.prompt_prewarmer.schedule(session_id, build)
+        
+    def format_status(self):
+        """Сводка о состоянии бота для администраторов"""
+        lines = ["📊 Состояние бота"]
+        
+        if self.loop_monitor:
+            stats = self.loop_monitor.get_stats()
+            lines.append(
+                f"Задержка цикла событий: p50 {stats['p50'] * 1000:.1f} мс, "
+                f"p95 {stats['p95'] * 1000:.1f} мс, p99 {stats['p99'] * 1000:.1f} мс, "
+                f"макс. {stats['max'] * 1000:.1f} мс, блокировок {stats['slow_callbacks']}"
+            )
+        
+        for endpoint in self.deepseek_client.get_endpoint_stats():
+            p95 = f"{endpoint['p95']:.2f} с" if endpoint["p95"] is not None else "—"
+            lines.append(
+                f"{endpoint['url']}: {'доступен' if endpoint['healthy'] else 'недоступен'}, "
+                f"запросов {endpoint['requests']}, ошибок {endpoint['failures']}, p95 первого токена {p95}"
+            )
+        
+        prewarm = self.prompt_prewarmer.get_stats()
+        lines.append(
+            f"Подготовленные промпты: попаданий {prewarm['hits']}, промахов {prewarm['misses']}, "
+            f"экономия {prewarm['saved_ms_per_hit']:.2f} мс за ход (последний {prewarm['saved_ms_last']:.2f} мс)"
+        )
+        
+        lines.append(f"Диалогов: {len(conversations)}")
+        if self.scene_manager:
+            lines.append(f"Групповых сцен: {self.scene_manager.get_active_scenes_count()}")
+        
+        return "\n".join(lines)
+        
+    def format_config(self):
+        """Активные значения перезагружаемых настроек для администраторов"""
+        watcher = self.config_watcher
+        if not watcher:
+            return "⚙️ Файл настроек отключен (CONFIG_FILE пуст)"
+        
+        loaded = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(watcher.loaded_at)) if watcher.loaded_at else "не загружался"
+        lines = [f"⚙️ Настройки: {watcher.path}, версия {watcher.version}, загружен {loaded}"]
+        if watcher.last_error:
+            lines.append(f"Последняя ошибка: {watcher.last_error}")
+        
+        for name, value, overridden in watcher.get_active():
+            if name == "SYSTEM_PROMPT" and len(value) > 100:
+                value = value[:100] + "…"
+            lines.append(f"{'*' if overridden else ' '} {name} = {json.dumps(value, ensure_ascii=False)}")
+        lines.append("* — задано в файле, остальное — из окружения")
+        # Сообщения уходят с parse_mode HTML, а промпт может содержать угловые скобки
+        return html.escape("\n".join(lines), quote=False)
+        
+    def format_usage(self, summary):
+        """Сводка о расходе токенов для администраторов"""
+        def describe(row):
+            return (
+                f"{row['requests']} запр., вход {row['prompt_tokens']} "
+                f"(кэш {row['cached_tokens']}), выход {row['completion_tokens']}, "
+                f"~${row['cost']:.4f}, {row['avg_latency']:.1f} с"
+            )
+        
+        if not summary["totals"]:
+            return f"💰 С {summary['since']} запросов не было"
+        
+        lines = [f"💰 Расход с {summary['since']}", f"Всего: {describe(summary['totals'])}", "", "Пользователи:"]
+        lines += [f"{row['key']}: {describe(row)}" for row in summary["top_users"]]
+        lines += ["", "Чаты:"]
+        lines += [f"{row['key']}: {describe(row)}" for row in summary["top_chats"]]
+        lines += ["", "Версии лора:"]
+        lines += [f"{row['key'] or 'без лора'}: {describe(row)}" for row in summary["lore_versions"]]
+        return "\n".join(lines)
+        
+    async def resolve_scene_round(self, scene, actions):
+        """Озвучить раунд групповой сцены одним запросом"""
+        # Обновления действий раунда завершаются только после сохранения его ответа
+        update_ids = [update_id for *_, update_id in actions if update_id is not None]
+        
+        scene.add_message("user", format_round(actions), self.config.MAX_HISTORY_LENGTH)
+        
+        ai_response = await self.get_deepseek_response(
+            scene.history, scene.chat_id, f"{self.config.SYSTEM_PROMPT}\n\n{SCENE_PROMPT}",
+            {"chat_id": scene.chat_id, "purpose": "scene", "user_ids": [user_id for user_id, *_ in actions]}
+        )
+        
+        scene.add_message("assistant", ai_response, self.config.MAX_HISTORY_LENGTH)
+        await self.send_message(scene.chat_id, ai_response, update_ids)
+        if self.update_queue and update_ids:
+            await self.update_queue.complete(update_ids[0])
+        
+        self.schedule_prewarm(
+            scene.chat_id, scene.history, self.config.MAX_HISTORY_LENGTH, f"{self.config.SYSTEM_PROMPT}\n\n{SCENE_PROMPT}"
+        )
+        
+        logger.info(f"Раунд {scene.round_number} в чате {scene.chat_id} озвучен ({len(actions)} действий)")
             
     async def handle_message(self, message):
-        """Обработать сообщение"""
+        """Обработать сообщение; True, если обновление завершится позже, с раундом сцены"""
         user_id = message["from"]["id"]
         chat_id = message["chat"]["id"]
         text = message.get("text", "")
+        is_group = message["chat"].get("type") in ("group", "supergroup")
+        
+        # В групповой сцене история и состояние мира общие для всего чата
+        session_id = chat_id if is_group and self.scene_manager else user_id
         
         logger.info(f"Получено сообщение от пользователя {user_id}: {text[:50]}...")
         
@@ -115,6 +350,14 @@ class TelegramBot:
             
         elif text.startswith("/reset"):
             conversations.pop(user_id, None)
+            if self.scene_manager and is_group:
+                # Сброшенные действия не будут озвучены, их обновления завершаются сразу
+                for *_, update_id in self.scene_manager.reset(chat_id):
+                    if self.update_queue and update_id is not None:
+                        await self.update_queue.complete(update_id)
+            if self.world_state_manager:
+                self.world_state_manager.reset(session_id)
+            self.prompt_prewarmer.discard(session_id)
             await self.send_message(chat_id, "История разговора сброшена!")
             return
             
@@ -129,20 +372,60 @@ class TelegramBot:
 /reset - сбросить историю разговора
 /help - показать это сообщение
 /lore - информация о загруженном лоре
+/state - текущее состояние мира
 /reload_lore - перезагрузить лор из файлов
 
 Бот запоминает контекст разговора и играет роль в соответствии с лором мира.
+В групповом чате все игроки участвуют в одной сцене: их действия собираются в раунды, и бот описывает исход раунда одним сообщением.
             """
             await self.send_message(chat_id, help_text)
             return
             
         elif text.startswith("/lore"):
+            if not self.lore_manager.is_ready():
+                await self.send_message(chat_id, "📚 Лор еще загружается")
+                return
             lore_info = self.lore_manager.get_lore_summary()
             await self.send_message(chat_id, f"📚 Лор: {lore_info}")
             return
             
+        elif text.startswith("/state"):
+            world_block = self.world_state_manager.get_prompt_block(session_id) if self.world_state_manager else ""
+            await self.send_message(chat_id, world_block or "🌍 Состояние мира пока не записано")
+            return
+            
+        elif text.startswith("/status"):
+            if user_id not in self.config.ADMIN_USER_IDS:
+                await self.send_message(chat_id, "⛔ Команда доступна только администраторам")
+                return
+            await self.send_message(chat_id, self.format_status())
+            return
+            
+        elif text.startswith("/config"):
+            if user_id not in self.config.ADMIN_USER_IDS:
+                await self.send_message(chat_id, "⛔ Команда доступна только администраторам")
+                return
+            await self.send_message(chat_id, self.format_config())
+            return
+            
+        elif text.startswith("/usage_export"):
+            if user_id not in self.config.ADMIN_USER_IDS or not self.usage_tracker:
+                await self.send_message(chat_id, "⛔ Команда доступна только администраторам")
+                return
+            report = await self.usage_tracker.export_csv(30)
+            await self.send_document(chat_id, "usage.csv", report.encode("utf-8"))
+            return
+            
+        elif text.startswith("/usage"):
+            if user_id not in self.config.ADMIN_USER_IDS or not self.usage_tracker:
+                await self.send_message(chat_id, "⛔ Команда доступна только администраторам")
+                return
+            days = int(text.split()[1]) if len(text.split()) > 1 and text.split()[1].isdigit() else 1
+            await self.send_message(chat_id, self.format_usage(await self.usage_tracker.get_summary(days)))
+            return
+            
         elif text.startswith("/reload_lore"):
-            self.lore_manager.reload_lore()
+            await self.lore_manager.reload_lore_async()
             lore_info = self.lore_manager.get_lore_summary()
             await self.send_message(chat_id, f"🔄 Лор перезагружен: {lore_info}")
             return
@@ -150,6 +433,17 @@ class TelegramBot:
         # Обработка обычных сообщений
         if not text or text.startswith("/"):
             return
+        
+        # Проверить квоту токенов до обращения к AI
+        if self.usage_tracker and not self.usage_tracker.is_within_quota(user_id, chat_id if is_group else None):
+            await self.send_message(chat_id, "⚠️ Дневной лимит токенов исчерпан. Попробуйте завтра.")
+            return
+        
+        # Групповая сцена: действие попадает в текущий раунд
+        if is_group and self.scene_manager:
+            name = message["from"].get("first_name") or message["from"].get("username") or str(user_id)
+            self.scene_manager.submit(chat_id, user_id, name, text, current_update_id.get())
+            return True
             
         # Получить историю разговора
         history = conversations.setdefault(user_id, [])
@@ -157,13 +451,15 @@ class TelegramBot:
         # Добавить сообщение пользователя
         history.append({"role": "user", "content": text})
         
-        # Ограничить историю (оставить последние 50 сообщений)
-        if len(history) > 50:
-            conversations[user_id] = history[-50:]
+        # Ограничить историю
+        if len(history) > self.config.MAX_HISTORY_LENGTH:
+            conversations[user_id] = history[-self.config.MAX_HISTORY_LENGTH:]
             history = conversations[user_id]
         
         # Получить ответ от AI
-        ai_response = await self.get_deepseek_response(history)
+        ai_response = await self.get_deepseek_response(
+            history, session_id, usage_tags={"user_id": user_id, "chat_id": chat_id, "purpose": "chat"}
+        )
         
         # Добавить ответ AI в историю
         history.append({"role": "assistant", "content": ai_response})
@@ -171,21 +467,78 @@ class TelegramBot:
         # Отправить ответ пользователю
         await self.send_message(chat_id, ai_response)
         
+        # Подготовить промпт следующего хода
+        self.schedule_prewarm(session_id, history, self.config.MAX_HISTORY_LENGTH)
+        
         logger.info(f"Отправлен ответ пользователю {user_id}")
         
+    async def process_update(self, update):
+        """Обработать обновление и отметить его выполненным в очереди"""
+        token = current_update_id.set(update["update_id"])
+        deferred = False
+        try:
+            if "message" in update:
+                deferred = await self.handle_message(update["message"])
+        except Exception as e:
+            # Обновление остается незавершенным и будет доделано при следующем запуске
+            logger.error(f"Ошибка обработки обновления {update['update_id']}: {e}")
+            return
+        finally:
+            current_update_id.reset(token)
+        
+        if self.update_queue and not deferred:
+            await self.update_queue.complete(update["update_id"])
+    
+    async def replay_unfinished(self):
+        """Доделать обновления, прерванные прошлым сбоем"""
+        unfinished = await self.update_queue.get_unfinished()
+        if unfinished:
+            logger.info(f"Повторная обработка {len(unfinished)} незавершенных обновлений")
+        
+        for update, replies in unfinished:
+            try:
+                if replies:
+                    # Ответ уже получен - отправить неотправленное, не обращаясь к AI повторно
+                    for reply_id, chat_id, text, sent in replies:
+                        if sent:
+                            continue
+                        try:
+                            await self.post_message(chat_id, text)
+                        except TelegramAPIError as e:
+                            if e.retryable:
+                                raise
+                            logger.error(f"Ответ на обновление {update['update_id']} отклонен без повтора: {e}")
+                            await self.update_queue.mark_failed(reply_id)
+                            continue
+                        await self.update_queue.mark_sent(reply_id)
+                    await self.update_queue.complete(update["update_id"])
+                else:
+                    await self.process_update(update)
+            except Exception as e:
+                # Одна неудачная отправка не должна мешать запуску; попытка повторится при следующем
+                logger.error(f"Не удалось повторно отправить ответ на обновление {update['update_id']}: {e}")
+        
     async def run(self):
         """Запустить бота"""
         logger.info("Запуск бота...")
         
         # Проверить токен
-        if not TELEGRAM_BOT_TOKEN:
+        if not self.config.TELEGRAM_BOT_TOKEN:
             logger.error("TELEGRAM_BOT_TOKEN не найден")
             return
             
-        if not DEEPSEEK_API_KEY:
+        if not self.config.DEEPSEEK_API_KEY:
             logger.error("DEEPSEEK_API_KEY не найден")
             return
         
+        if self.loop_monitor:
+            self.loop_monitor.start()
+        
+        if self.config_watcher:
+            self.config_watcher.start()
+        
+        self.lore_task = asyncio.ensure_future(self.lore_manager.load_lore_async())
+        
         # Получить информацию о боте
         session = await self.get_session()
         async with session.get(f"{self.api_url}/getMe") as response:
@@ -200,6 +553,16 @@ class TelegramBot:
         offset = None
         
         try:
+            if self.usage_tracker:
+                await self.usage_tracker.open()
+            
+            # Ошибки при открытии очереди и повторе тоже проходят через close()
+            if self.update_queue:
+                await self.update_queue.open()
+                await self.update_queue.prune(self.config.QUEUE_RETENTION)
+                offset = await self.update_queue.get_offset()
+                await self.replay_unfinished()
+            
             while True:
                 # Получить обновления
                 updates = await self.get_updates(offset)
@@ -209,18 +572,21 @@ class TelegramBot:
                     await asyncio.sleep(5)
                     continue
                 
+                # Сохранить всю пачку обновлений и offset одной транзакцией
+                done_ids = set()
+                if self.update_queue:
+                    done_ids = await self.update_queue.record_updates(updates["result"])
+                
                 # Обработать каждое обновление
                 for update in updates["result"]:
-                    try:
-                        # Обновить offset
-                        offset = update["update_id"] + 1
-                        
-                        # Обработать сообщение
-                        if "message" in update:
-                            await self.handle_message(update["message"])
-                            
-                    except Exception as e:
-                        logger.error(f"Ошибка обработки обновления {update['update_id']}: {e}")
+                    # Обновить offset
+                    offset = update["update_id"] + 1
+                    
+                    # Повторно доставленные обновления уже обработаны
+                    if update["update_id"] in done_ids:
+                        continue
+                    
+                    await self.process_update(update)
                         
                 # Если нет обновлений, подождать немного
                 if not updates["result"]:
@@ -234,7 +600,13 @@ class TelegramBot:
             await self.close()
 
 async def main():
-    bot = TelegramBot(TELEGRAM_BOT_TOKEN)
+    # Проверить конфигурацию до создания бота
+    config = Config()
+    if not config.validate():
+        logger.error("TELEGRAM_BOT_TOKEN и DEEPSEEK_API_KEY должны быть заданы")
+        return
+    
+    bot = TelegramBot(config.TELEGRAM_BOT_TOKEN, config)
     await bot.run()
 
 if __name__ == "__main__":
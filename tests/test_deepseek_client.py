@@ -0,0 +1,182 @@
+"""Hedging, failover and endpoint health against the fake DeepSeek server."""
+
+import time
+import asyncio
+
+import pytest
+
+from config import Config
+from deepseek_client import DeepSeekAPIError, DeepSeekClient
+from fake_deepseek_server import FakeDeepSeekServer
+from usage_tracker import UsageTracker
+
+MESSAGES = [{"role": "user", "content": "Йонас осматривается"}]
+
+def make_client(monkeypatch, urls, **env) -> DeepSeekClient:
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "test")
+    monkeypatch.setenv("DEEPSEEK_URLS", ",".join(urls))
+    for name, value in env.items():
+        monkeypatch.setenv(name, str(value))
+    return DeepSeekClient(Config())
+
+def test_hedged_request_beats_slow_endpoint(monkeypatch):
+    async def run():
+        slow = FakeDeepSeekServer(delay=0.0, slow_rate=1.0, slow_delay=3.0)
+        fast = FakeDeepSeekServer(delay=0.0)
+        slow_url, fast_url = await slow.start(), await fast.start()
+        # The slow endpoint is practically always picked first, the fast one is the backup
+        client = make_client(
+            monkeypatch, [slow_url, fast_url],
+            DEEPSEEK_URL_WEIGHTS="1,0.000001", HEDGE_DEFAULT_DELAY=0.2, HEDGE_MIN_DELAY=0.1
+        )
+        try:
+            started = time.monotonic()
+            reply = await client.get_response(MESSAGES)
+            elapsed = time.monotonic() - started
+            stats = {s["url"]: s for s in client.get_endpoint_stats()}
+        finally:
+            await client.close()
+            await slow.stop()
+            await fast.stop()
+
+        assert reply.strip() == fast.reply
+        assert elapsed < 1.5
+        assert slow.requests == 1 and fast.requests == 1
+        # The losing attempt was cancelled and released its endpoint
+        assert stats[slow_url]["in_flight"] == 0
+        assert stats[slow_url]["failures"] == 0
+
+    asyncio.run(run())
+
+def test_abandoned_hedge_attempt_is_accounted(monkeypatch, tmp_path):
+    async def run():
+        slow = FakeDeepSeekServer(delay=0.0, slow_rate=1.0, slow_delay=3.0)
+        fast = FakeDeepSeekServer(delay=0.0)
+        slow_url, fast_url = await slow.start(), await fast.start()
+        client = make_client(
+            monkeypatch, [slow_url, fast_url],
+            DEEPSEEK_URL_WEIGHTS="1,0.000001", HEDGE_DEFAULT_DELAY=0.2, HEDGE_MIN_DELAY=0.1
+        )
+        tracker = UsageTracker(str(tmp_path / "usage.sqlite3"))
+        client.usage_tracker = tracker
+        try:
+            await client.get_response(MESSAGES, usage_tags={"user_id": 5, "chat_id": 5, "purpose": "chat"})
+        finally:
+            await client.close()
+            await slow.stop()
+            await fast.stop()
+            await tracker.close()
+
+        return {record[5]: record for record in tracker.buffer}, tracker
+
+    records, tracker = asyncio.run(run())
+    # close() flushes nothing without an open database, so the buffer still holds the records
+    assert set(records) == {"chat", "hedge"}
+    hedge = records["hedge"]
+    assert hedge[1] == 5 and hedge[2] == 5
+    assert hedge[6] > 0 and hedge[7] == 0
+    assert tracker.get_daily_tokens(5) == records["chat"][6] + records["chat"][7] + hedge[6]
+
+def test_failover_to_healthy_endpoint(monkeypatch):
+    async def run():
+        failing = FakeDeepSeekServer(delay=0.0, error_rate=1.0)
+        healthy = FakeDeepSeekServer(delay=0.0)
+        failing_url, healthy_url = await failing.start(), await healthy.start()
+        client = make_client(
+            monkeypatch, [failing_url, healthy_url],
+            DEEPSEEK_URL_WEIGHTS="1,0.000001", HEDGE_ENABLED="false"
+        )
+        try:
+            reply = await client.get_response(MESSAGES)
+            stats = {s["url"]: s for s in client.get_endpoint_stats()}
+        finally:
+            await client.close()
+            await failing.stop()
+            await healthy.stop()
+
+        assert reply.strip() == healthy.reply
+        assert failing.requests == 1 and healthy.requests == 1
+        assert stats[failing_url]["failures"] == 1
+
+    asyncio.run(run())
+
+def test_failing_endpoint_is_marked_down(monkeypatch):
+    async def run():
+        failing = FakeDeepSeekServer(delay=0.0, error_rate=1.0)
+        failing_url = await failing.start()
+        client = make_client(
+            monkeypatch, [failing_url],
+            MAX_UPSTREAM_ATTEMPTS=1, ENDPOINT_FAILURE_THRESHOLD=2, ENDPOINT_COOLDOWN=60
+        )
+        try:
+            with pytest.raises(DeepSeekAPIError):
+                await client.get_response(MESSAGES)
+            assert client.get_endpoint_stats()[0]["healthy"]
+
+            with pytest.raises(DeepSeekAPIError):
+                await client.get_response(MESSAGES)
+            assert not client.get_endpoint_stats()[0]["healthy"]
+        finally:
+            await client.close()
+            await failing.stop()
+
+    asyncio.run(run())
+
+def test_single_endpoint_is_not_hedged(monkeypatch):
+    async def run():
+        slow = FakeDeepSeekServer(delay=0.0, slow_rate=1.0, slow_delay=0.5)
+        slow_url = await slow.start()
+        client = make_client(monkeypatch, [slow_url], HEDGE_DEFAULT_DELAY=0.1, HEDGE_MIN_DELAY=0.1)
+        try:
+            reply = await client.get_response(MESSAGES)
+        finally:
+            await client.close()
+            await slow.stop()
+
+        assert reply.strip() == slow.reply
+        # Waiting out the slow answer beats sending the same prompt again
+        assert slow.requests == 1
+
+    asyncio.run(run())
+
+def test_retry_of_failed_endpoint_backs_off(monkeypatch):
+    async def run():
+        failing = FakeDeepSeekServer(delay=0.0, error_rate=1.0)
+        failing_url = await failing.start()
+        client = make_client(
+            monkeypatch, [failing_url],
+            MAX_UPSTREAM_ATTEMPTS=3, UPSTREAM_RETRY_BACKOFF=0.2, ENDPOINT_FAILURE_THRESHOLD=10
+        )
+        try:
+            started = time.monotonic()
+            with pytest.raises(DeepSeekAPIError):
+                await client.get_response(MESSAGES)
+            elapsed = time.monotonic() - started
+        finally:
+            await client.close()
+            await failing.stop()
+
+        assert failing.requests == 3
+        # 0.2s before the second attempt, 0.4s before the third
+        assert elapsed >= 0.6
+
+    asyncio.run(run())
+
+def test_side_requests_do_not_sample_latency(monkeypatch):
+    async def run():
+        server = FakeDeepSeekServer(delay=0.0)
+        url = await server.start()
+        client = make_client(monkeypatch, [url])
+        try:
+            await client.get_response(MESSAGES, record_latency=False)
+            side = client.endpoint_pool.endpoints[0].latencies.copy()
+            await client.get_response(MESSAGES)
+            chat = client.endpoint_pool.endpoints[0].latencies.copy()
+        finally:
+            await client.close()
+            await server.stop()
+
+        assert len(side) == 0
+        assert len(chat) == 1
+
+    asyncio.run(run())
@@ -0,0 +1,26 @@
+"""Loop lag measurement and detection of code blocking the loop."""
+
+import time
+import asyncio
+
+from loop_monitor import LoopMonitor
+
+def test_blocking_call_is_detected():
+    async def run():
+        monitor = LoopMonitor(interval=0.02, slow_threshold=0.1, log_interval=60)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.2)
+            time.sleep(0.3)
+            await asyncio.sleep(0.1)
+        finally:
+            await monitor.stop()
+        return monitor.get_stats(), monitor.last_slow_stack
+
+    stats, stack = asyncio.run(run())
+    assert stats["slow_callbacks"] == 1
+    assert "time.sleep(0.3)" in stack
+    assert stats["max"] >= 0.25
+    assert stats["p99"] >= 0.25
+    # The stall is one sample among many quick wake-ups
+    assert stats["p50"] < 0.05
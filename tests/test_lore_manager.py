@@ -0,0 +1,33 @@
+"""Lore loading and search."""
+
+import asyncio
+
+from lore_manager import LoreManager
+
+def write_lore(tmp_path) -> str:
+    lore_file = tmp_path / "lore.txt"
+    lore_file.write_text("Глеб чинит генератор.\nШрамыч охраняет склад.", encoding="utf-8")
+    return str(lore_file)
+
+def test_lore_is_indexed_for_search(tmp_path):
+    manager = LoreManager([write_lore(tmp_path)])
+
+    assert manager.is_ready()
+    assert "Глеб" in manager.lore_content
+    assert manager.search_lore("шрамыч") == ["Шрамыч охраняет склад."]
+    assert len(manager.version) == 12
+
+def test_failed_load_still_marks_lore_ready(tmp_path, monkeypatch):
+    manager = LoreManager([write_lore(tmp_path)], lazy=True)
+
+    def fail():
+        raise RuntimeError("disk error")
+
+    monkeypatch.setattr(manager, "load_lore", fail)
+
+    async def run():
+        await manager.load_lore_async()
+        return await manager.wait_ready(0.1)
+
+    assert asyncio.run(run())
+    assert manager.get_system_prompt("base") == "base"
@@ -0,0 +1,42 @@
+"""Prepared prompt prefixes: matching and the per-session bound."""
+
+import asyncio
+
+from deepseek_client import encode_messages
+from prompt_cache import PromptPrewarmer
+
+HISTORY = [{"role": "user", "content": "Йонас входит"}, {"role": "assistant", "content": "Темно."}]
+
+def prepare(prewarmer: PromptPrewarmer, session_id, system_prompt: str):
+    async def build():
+        return system_prompt, list(HISTORY)
+
+    prewarmer.schedule(session_id, build)
+
+def test_prepared_prefix_is_served_only_when_it_matches():
+    async def run():
+        prewarmer = PromptPrewarmer()
+        prepare(prewarmer, 1, "лор")
+        await asyncio.gather(*prewarmer.tasks)
+        hit = await prewarmer.get_prefix(1, "лор", list(HISTORY))
+
+        prepare(prewarmer, 1, "лор")
+        await asyncio.gather(*prewarmer.tasks)
+        miss = await prewarmer.get_prefix(1, "новый лор", list(HISTORY))
+        return prewarmer, hit, miss
+
+    prewarmer, hit, miss = asyncio.run(run())
+    assert hit == encode_messages([{"role": "system", "content": "лор"}] + HISTORY)
+    assert miss == encode_messages([{"role": "system", "content": "новый лор"}] + HISTORY)
+    assert (prewarmer.hits, prewarmer.misses) == (1, 1)
+
+def test_least_recently_active_sessions_are_dropped():
+    async def run():
+        prewarmer = PromptPrewarmer(max_sessions=2)
+        for session_id in (1, 2, 3):
+            prepare(prewarmer, session_id, "лор")
+            await asyncio.gather(*prewarmer.tasks)
+        return prewarmer
+
+    prewarmer = asyncio.run(run())
+    assert list(prewarmer.prepared) == [2, 3]
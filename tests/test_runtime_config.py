@@ -0,0 +1,102 @@
+"""Hot-reloaded runtime configuration: validation, fallbacks and listeners."""
+
+import os
+import json
+import itertools
+
+from config import Config
+from deepseek_client import DeepSeekClient
+from runtime_config import ConfigWatcher
+
+# Distinct modification times for successive writes of the file
+MTIMES = itertools.count(1)
+
+URLS = ["http://a.test/chat/completions", "http://b.test/chat/completions"]
+
+def make_watcher(monkeypatch, tmp_path, **env) -> ConfigWatcher:
+    monkeypatch.setenv("DEEPSEEK_URLS", URLS[0])
+    monkeypatch.setenv("MAX_HISTORY_LENGTH", "50")
+    for name, value in env.items():
+        monkeypatch.setenv(name, str(value))
+    return ConfigWatcher(Config(), str(tmp_path / "runtime_config.json"))
+
+def write(watcher: ConfigWatcher, settings: dict):
+    with open(watcher.path, "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+    # Make every write visible to the change check, however fast the test runs
+    mtime = next(MTIMES)
+    os.utime(watcher.path, (mtime, mtime))
+
+def test_invalid_file_keeps_active_settings(monkeypatch, tmp_path):
+    watcher = make_watcher(monkeypatch, tmp_path)
+    write(watcher, {"MAX_HISTORY_LENGTH": 30, "REQUEST_TIMEOUT": 45})
+    assert watcher.load() == {"MAX_HISTORY_LENGTH", "REQUEST_TIMEOUT"}
+
+    # One bad value rejects the whole file, including its valid settings
+    write(watcher, {"MAX_HISTORY_LENGTH": 20, "REQUEST_TIMEOUT": "soon"})
+    assert watcher.load() == set()
+    assert "REQUEST_TIMEOUT" in watcher.last_error
+    assert (watcher.config.MAX_HISTORY_LENGTH, watcher.config.REQUEST_TIMEOUT) == (30, 45)
+
+    with open(watcher.path, "w", encoding="utf-8") as f:
+        f.write("{not json")
+    mtime = next(MTIMES)
+    os.utime(watcher.path, (mtime, mtime))
+    assert watcher.load() == set()
+    assert "invalid JSON" in watcher.last_error
+    assert watcher.config.MAX_HISTORY_LENGTH == 30
+
+def test_removed_setting_falls_back_to_environment(monkeypatch, tmp_path):
+    watcher = make_watcher(monkeypatch, tmp_path)
+    write(watcher, {"MAX_HISTORY_LENGTH": 30, "REQUEST_TIMEOUT": 45})
+    watcher.load()
+
+    write(watcher, {"REQUEST_TIMEOUT": 45})
+    assert watcher.load() == {"MAX_HISTORY_LENGTH"}
+    assert watcher.config.MAX_HISTORY_LENGTH == 50
+    assert watcher.config.REQUEST_TIMEOUT == 45
+
+def test_booleans_are_not_numbers(monkeypatch, tmp_path):
+    watcher = make_watcher(monkeypatch, tmp_path)
+    write(watcher, {"MAX_UPSTREAM_ATTEMPTS": True})
+    assert watcher.load() == set()
+    assert "MAX_UPSTREAM_ATTEMPTS" in watcher.last_error
+
+    write(watcher, {"HEDGE_ENABLED": 1})
+    assert watcher.load() == set()
+    assert "HEDGE_ENABLED" in watcher.last_error
+
+    write(watcher, {"HEDGE_ENABLED": False, "MAX_UPSTREAM_ATTEMPTS": 2})
+    assert watcher.load() == {"HEDGE_ENABLED", "MAX_UPSTREAM_ATTEMPTS"}
+    assert watcher.config.MAX_UPSTREAM_ATTEMPTS == 2
+
+def test_listeners_get_the_changed_settings(monkeypatch, tmp_path):
+    watcher = make_watcher(monkeypatch, tmp_path)
+    client = DeepSeekClient(watcher.config)
+    calls = []
+    watcher.add_listener(calls.append)
+    watcher.add_listener(client.apply_config)
+
+    write(watcher, {"DEEPSEEK_URLS": URLS, "DEEPSEEK_URL_WEIGHTS": [1, 3]})
+    watcher.load()
+    assert calls == [{"DEEPSEEK_URLS", "DEEPSEEK_URL_WEIGHTS"}]
+    assert [(e.url, e.weight) for e in client.endpoint_pool.endpoints] == [(URLS[0], 1.0), (URLS[1], 3.0)]
+
+    # Unchanged values are not reported again
+    write(watcher, {"DEEPSEEK_URLS": URLS, "DEEPSEEK_URL_WEIGHTS": [1, 3], "REQUEST_TIMEOUT": 45})
+    watcher.load()
+    assert calls[-1] == {"REQUEST_TIMEOUT"}
+
+def test_weights_must_match_the_active_urls(monkeypatch, tmp_path):
+    watcher = make_watcher(monkeypatch, tmp_path, DEEPSEEK_URL_WEIGHTS="2")
+    # The environment's single weight does not fit two URLs from the file
+    write(watcher, {"DEEPSEEK_URLS": URLS})
+    assert watcher.load() == set()
+    assert "DEEPSEEK_URL_WEIGHTS" in watcher.last_error
+    assert watcher.config.DEEPSEEK_URLS == [URLS[0]]
+
+    write(watcher, {"DEEPSEEK_URL_WEIGHTS": [1, 2]})
+    assert watcher.load() == set()
+
+    write(watcher, {"DEEPSEEK_URLS": URLS, "DEEPSEEK_URL_WEIGHTS": [1, 2]})
+    assert watcher.load() == {"DEEPSEEK_URLS", "DEEPSEEK_URL_WEIGHTS"}
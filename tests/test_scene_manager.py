@@ -0,0 +1,68 @@
+"""Group-chat rounds: closing, fairness and the per-player backlog."""
+
+import asyncio
+
+from config import Config
+from scene_manager import Scene, SceneManager
+
+def make_manager(monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, str(value))
+    rounds = []
+
+    async def resolve_round(scene, actions):
+        rounds.append([text for _, _, text, _ in actions])
+
+    return SceneManager(Config(), resolve_round), rounds
+
+def test_round_closes_when_active_players_have_acted():
+    scene = Scene(1)
+    for user_id in (1, 2):
+        scene.add_action((user_id, f"P{user_id}", "жду", None), max_actions=8)
+    assert not scene.round_full.is_set()
+    scene.take_round()
+
+    # Both acted last round, so the round closes once both act again
+    scene.add_action((1, "P1", "иду", None), max_actions=8)
+    assert not scene.round_full.is_set()
+    scene.add_action((2, "P2", "стою", None), max_actions=8)
+    assert scene.round_full.is_set()
+
+def test_round_closes_at_max_actions():
+    scene = Scene(1)
+    assert scene.add_action((1, "P1", "a", None), max_actions=2)
+    assert scene.add_action((2, "P2", "b", None), max_actions=2)
+    assert scene.round_full.is_set()
+    assert not scene.add_action((3, "P3", "c", None), max_actions=2)
+    assert list(scene.backlog) == [(3, "P3", "c", None)]
+
+def test_longest_waiting_player_goes_first():
+    scene = Scene(1)
+    scene.add_action((1, "P1", "раз", None), max_actions=8)
+    scene.take_round()
+    scene.add_action((2, "P2", "два", None), max_actions=8)
+    scene.take_round()
+
+    # Player 1 acted longer ago than player 2, and player 3 never acted
+    for user_id in (2, 1, 3):
+        scene.add_action((user_id, f"P{user_id}", str(user_id), None), max_actions=8)
+    assert [action[0] for action in scene.take_round()] == [3, 1, 2]
+
+def test_backlogged_messages_keep_their_order(monkeypatch):
+    async def run():
+        manager, rounds = make_manager(monkeypatch, SCENE_ROUND_WINDOW=0.05)
+        record = manager.resolve_round
+
+        async def resolve_round(scene, actions):
+            await record(scene, actions)
+            # A new message while the round is narrated and msg2 still waits in the backlog
+            if len(rounds) == 1:
+                manager.submit(1, 7, "P7", "msg3")
+
+        manager.resolve_round = resolve_round
+        manager.submit(1, 7, "P7", "msg1")
+        manager.submit(1, 7, "P7", "msg2")
+        await manager.get_scene(1).round_task
+        return rounds
+
+    assert asyncio.run(run()) == [["msg1"], ["msg2"], ["msg3"]]
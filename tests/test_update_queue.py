@@ -0,0 +1,233 @@
+"""Durable update queue: failed sends survive a restart and are replayed."""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from config import Config
+from fake_deepseek_server import FakeDeepSeekServer
+from telegram_bot_main import TelegramBot
+from update_queue import UpdateQueue
+
+UPDATE = {
+    "update_id": 7,
+    "message": {
+        "message_id": 7,
+        "from": {"id": 1, "first_name": "Йонас"},
+        "chat": {"id": 1, "type": "private"},
+        "text": "Йонас открывает дверь"
+    }
+}
+
+# Telegram errors that retrying cannot fix
+REJECTIONS = {
+    400: "Bad Request: can't parse entities",
+    403: "Forbidden: bot was blocked by the user"
+}
+
+class FakeTelegramServer:
+    """sendMessage endpoint that can be switched to failing."""
+
+    def __init__(self):
+        self.fail_status = None
+        self.sent = []
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/sendMessage", self.send_message)
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        if self.fail_status == 502:
+            return web.Response(status=502, text="Bad Gateway")
+        if self.fail_status == 429:
+            return web.json_response(
+                {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 5"},
+                status=429
+            )
+        if self.fail_status in REJECTIONS:
+            return web.json_response(
+                {"ok": False, "error_code": self.fail_status, "description": REJECTIONS[self.fail_status]},
+                status=self.fail_status
+            )
+        self.sent.append(data)
+        return web.json_response({"ok": True, "result": {"message_id": len(self.sent)}})
+
+    async def start(self) -> str:
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+async def start_bot(monkeypatch, queue_path, telegram_url, deepseek_url) -> TelegramBot:
+    for name, value in {
+        "DEEPSEEK_API_KEY": "test",
+        "DEEPSEEK_URLS": deepseek_url,
+        "TELEGRAM_API_URL": telegram_url,
+        "QUEUE_DB_PATH": queue_path,
+        "USAGE_DB_PATH": "",
+        "CONFIG_FILE": "",
+        "WORLD_STATE_ENABLED": "false"
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    bot = TelegramBot("test", Config())
+    # The lore is not needed here; answer with the base prompt only
+    bot.lore_manager.ready.set()
+    await bot.update_queue.open()
+    return bot
+
+@pytest.mark.parametrize("fail_status", [502, 429])
+def test_failed_send_is_replayed_after_restart(monkeypatch, tmp_path, fail_status):
+    async def run():
+        telegram = FakeTelegramServer()
+        deepseek = FakeDeepSeekServer(delay=0.0)
+        telegram_url, deepseek_url = await telegram.start(), await deepseek.start()
+        queue_path = str(tmp_path / "queue.sqlite3")
+
+        try:
+            # First run: the reply is generated but Telegram rejects it
+            telegram.fail_status = fail_status
+            bot = await start_bot(monkeypatch, queue_path, telegram_url, deepseek_url)
+            await bot.update_queue.record_updates([UPDATE])
+            await bot.process_update(UPDATE)
+
+            unfinished = await bot.update_queue.get_unfinished()
+            assert [update["update_id"] for update, _ in unfinished] == [7]
+            [(_, chat_id, text, sent)] = unfinished[0][1]
+            assert chat_id == 1 and not sent
+            await bot.close()
+
+            # Restart: the saved reply is sent without asking the model again
+            telegram.fail_status = None
+            bot = await start_bot(monkeypatch, queue_path, telegram_url, deepseek_url)
+            await bot.replay_unfinished()
+
+            assert [message["text"] for message in telegram.sent] == [text]
+            assert deepseek.requests == 1
+            assert await bot.update_queue.get_unfinished() == []
+            await bot.close()
+        finally:
+            await telegram.stop()
+            await deepseek.stop()
+
+    asyncio.run(run())
+
+@pytest.mark.parametrize("fail_status", sorted(REJECTIONS))
+def test_rejected_reply_is_not_retried(monkeypatch, tmp_path, fail_status):
+    async def run():
+        telegram = FakeTelegramServer()
+        deepseek = FakeDeepSeekServer(delay=0.0)
+        telegram_url, deepseek_url = await telegram.start(), await deepseek.start()
+        queue_path = str(tmp_path / "queue.sqlite3")
+
+        try:
+            telegram.fail_status = fail_status
+            bot = await start_bot(monkeypatch, queue_path, telegram_url, deepseek_url)
+            await bot.update_queue.record_updates([UPDATE])
+            await bot.process_update(UPDATE)
+            unfinished = await bot.update_queue.get_unfinished()
+            await bot.close()
+        finally:
+            await telegram.stop()
+            await deepseek.stop()
+
+        assert unfinished == []
+        assert telegram.sent == []
+
+    asyncio.run(run())
+
+def test_replay_gives_up_on_rejected_reply(monkeypatch, tmp_path):
+    async def run():
+        telegram = FakeTelegramServer()
+        deepseek = FakeDeepSeekServer(delay=0.0)
+        telegram_url, deepseek_url = await telegram.start(), await deepseek.start()
+        queue_path = str(tmp_path / "queue.sqlite3")
+
+        try:
+            # A reply saved before a crash, and the user has blocked the bot since
+            bot = await start_bot(monkeypatch, queue_path, telegram_url, deepseek_url)
+            await bot.update_queue.record_updates([UPDATE])
+            await bot.update_queue.add_reply(7, 1, "ответ")
+            await bot.close()
+
+            telegram.fail_status = 403
+            bot = await start_bot(monkeypatch, queue_path, telegram_url, deepseek_url)
+            await bot.replay_unfinished()
+            unfinished = await bot.update_queue.get_unfinished()
+            await bot.close()
+        finally:
+            await telegram.stop()
+            await deepseek.stop()
+
+        assert unfinished == []
+        assert deepseek.requests == 0
+
+    asyncio.run(run())
+
+def test_sent_replies_are_not_repeated(tmp_path):
+    async def run():
+        queue = UpdateQueue(str(tmp_path / "queue.sqlite3"))
+        await queue.open()
+        try:
+            await queue.record_updates([UPDATE])
+            first = await queue.add_reply(7, 1, "первый")
+            await queue.add_reply(7, 1, "второй")
+            await queue.mark_sent(first)
+
+            # Crash before the update was completed
+            [(update, replies)] = await queue.get_unfinished()
+            assert update["update_id"] == 7
+            assert [(text, sent) for _, _, text, sent in replies] == [("первый", True), ("второй", False)]
+
+            await queue.complete(7)
+            assert await queue.get_unfinished() == []
+            assert await queue.record_updates([UPDATE]) == {7}
+        finally:
+            await queue.close()
+
+    asyncio.run(run())
+
+def group_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": {"id": user_id, "first_name": f"Игрок {user_id}"},
+            "chat": {"id": -100, "type": "group"},
+            "text": text
+        }
+    }
+
+def test_scene_actions_stay_unfinished_until_the_round_reply_is_stored(monkeypatch, tmp_path):
+    async def run():
+        telegram = FakeTelegramServer()
+        deepseek = FakeDeepSeekServer(delay=0.0)
+        telegram_url, deepseek_url = await telegram.start(), await deepseek.start()
+        monkeypatch.setenv("SCENE_ROUND_WINDOW", "0.2")
+        updates = [group_update(20, 1, "Иду к воротам"), group_update(21, 2, "Прикрываю")]
+
+        try:
+            bot = await start_bot(monkeypatch, str(tmp_path / "queue.sqlite3"), telegram_url, deepseek_url)
+            await bot.update_queue.record_updates(updates)
+            for update in updates:
+                await bot.process_update(update)
+
+            # Waiting for the round: a crash now replays both actions
+            waiting = [update["update_id"] for update, _ in await bot.update_queue.get_unfinished()]
+
+            await bot.scene_manager.get_scene(-100).round_task
+            unfinished = await bot.update_queue.get_unfinished()
+            await bot.close()
+        finally:
+            await telegram.stop()
+            await deepseek.stop()
+
+        assert waiting == [20, 21]
+        assert unfinished == []
+        assert len(telegram.sent) == 1 and deepseek.requests == 1
+
+    asyncio.run(run())
@@ -0,0 +1,25 @@
+"""Usage attribution and daily quotas."""
+
+from usage_tracker import UsageTracker
+
+def test_scene_round_is_split_between_players(tmp_path):
+    tracker = UsageTracker(str(tmp_path / "usage.sqlite3"), user_daily_quota=600)
+    usage = {"prompt_tokens": 1001, "completion_tokens": 200, "prompt_cache_hit_tokens": 900}
+    tracker.record(usage, 1.5, chat_id=-100, purpose="scene", user_ids=[1, 2, 1])
+
+    # One record per distinct player; the shares add up to the whole request
+    assert [record[1] for record in tracker.buffer] == [1, 2]
+    assert [record[6:9] for record in tracker.buffer] == [(501, 100, 450), (500, 100, 450)]
+    assert tracker.get_daily_tokens(1) == 601 and tracker.get_daily_tokens(2) == 600
+    assert tracker.daily_tokens[("chat", -100)] == 1201
+
+    assert not tracker.is_within_quota(1, -100)
+    assert not tracker.is_within_quota(2, -100)
+    assert tracker.is_within_quota(3, -100)
+
+def test_single_user_request_is_recorded_once(tmp_path):
+    tracker = UsageTracker(str(tmp_path / "usage.sqlite3"))
+    tracker.record({"prompt_tokens": 10, "completion_tokens": 5}, 0.5, user_id=1, chat_id=1)
+
+    assert [record[1:3] + record[6:9] for record in tracker.buffer] == [(1, 1, 10, 5, 0)]
+    assert tracker.get_daily_tokens(1) == 15
@@ -0,0 +1,91 @@
+"""World-state updates: parsing the model's answer, caps and resets."""
+
+import json
+import asyncio
+
+from world_state import WorldState, WorldStateManager, parse_update
+
+class ScriptedClient:
+    """Answers extraction requests with a fixed update once released."""
+
+    def __init__(self, update: dict):
+        self.answer = "```json\n" + json.dumps(update, ensure_ascii=False) + "\n```"
+        self.release = asyncio.Event()
+        self.requests = 0
+
+    async def get_response(self, messages, **kwargs) -> str:
+        self.requests += 1
+        await self.release.wait()
+        return self.answer
+
+def test_parse_update_reads_fenced_json_only():
+    assert parse_update('```json\n{"location": "Рынок"}\n```') == {"location": "Рынок"}
+    assert parse_update("Ничего не изменилось") is None
+    assert parse_update('{"location": ') is None
+    assert parse_update("[1, 2]") is None
+
+def test_null_location_keeps_the_current_one():
+    state = WorldState()
+    state.apply_update({"location": "Старый порт"})
+    state.apply_update({"location": "null"})
+    state.apply_update({"location": None})
+    state.apply_update({"location": "  "})
+    assert state.location == "Старый порт"
+
+def test_lone_string_lists_are_items_not_characters():
+    state = WorldState()
+    state.apply_update({"inventory_add": "Фонарь", "quests_add": "Найти сестру"})
+    assert state.inventory == ["Фонарь"]
+    assert state.quests == ["Найти сестру"]
+
+    state.apply_update({"inventory_add": {"Нож": 1}, "inventory_remove": "фонарь", "quests_done": 5})
+    assert state.inventory == []
+    assert state.quests == ["Найти сестру"]
+
+def test_lists_are_capped_keeping_the_latest():
+    state = WorldState()
+    count = WorldState.MAX_ITEMS + 5
+    state.apply_update({
+        "inventory_add": [f"Предмет {i}" for i in range(count)],
+        "quests_add": [f"Задание {i}" for i in range(count)],
+        "npcs": {f"Персонаж {i}": "знакомый" for i in range(count)}
+    })
+    assert len(state.inventory) == len(state.quests) == len(state.npcs) == WorldState.MAX_ITEMS
+    assert state.inventory[0] == "Предмет 5" and state.inventory[-1] == f"Предмет {count - 1}"
+    assert "Персонаж 4" not in state.npcs and f"Персонаж {count - 1}" in state.npcs
+
+def test_reset_during_extraction_discards_the_update():
+    async def run():
+        client = ScriptedClient({"location": "Подвал", "inventory_add": ["Ключ"]})
+        manager = WorldStateManager(client)
+        manager.schedule_update(1, "Спускаюсь", "Внизу сыро.")
+        manager.schedule_update(1, "Ищу ключ", "Ключ под камнем.")
+        await asyncio.sleep(0)
+        assert client.requests == 1
+
+        manager.reset(1)
+        client.release.set()
+        await asyncio.gather(*manager.tasks)
+        return client, manager
+
+    client, manager = asyncio.run(run())
+    # The queued extraction belonged to the reset session and never ran
+    assert client.requests == 1
+    assert manager.get_prompt_block(1) == ""
+    assert manager.locks == {} and manager.scheduled == {}
+
+def test_locks_are_dropped_once_idle():
+    async def run():
+        client = ScriptedClient({"location": "Подвал"})
+        client.release.set()
+        manager = WorldStateManager(client)
+        manager.schedule_update(1, "Спускаюсь", "Внизу сыро.")
+        manager.schedule_update(1, "Осматриваюсь", "Темно.")
+        await manager.wait_idle(1)
+        await asyncio.gather(*manager.tasks)
+        return manager
+
+    manager = asyncio.run(run())
+    assert manager.get_state(1).location == "Подвал"
+    assert manager.get_state(1).turns == 2
+    assert manager.locks == {} and manager.scheduled == {}
@@ -0,0 +1,227 @@
+"""
+Durable queue of received Telegram updates and pending replies.
+
+Updates are written to SQLite before they are processed, together with the
+polling offset, and replies are written before they are sent. A reply is
+marked sent only once Telegram accepted it, or failed when Telegram rejected
+it for good (4xx other than 429), and an update is marked done only once its
+handler finished. After a crash or a failed send the bot replays
+unfinished updates on startup: updates that already produced a reply only get
+their unsent replies re-sent, the rest are processed again. Processing is
+idempotent by update_id, so updates delivered twice by Telegram are skipped.
+
+Group-scene actions wait for their round, so their updates stay unfinished
+until the round's reply is stored. One reply answers every update of the
+round: it is stored under the first one and the rest are completed with it.
+"""
+
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates (
+    update_id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS replies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    update_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS replies_update_id ON replies (update_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class UpdateQueue:
+    """SQLite-backed queue with at-least-once processing of updates."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection: Optional[sqlite3.Connection] = None
+        # A single thread owns the connection, so writes never block the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="update-queue")
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        """Open the database and create the schema."""
+        await self._run(self._open)
+        logger.info(f"Update queue opened at {self.path}")
+
+    def _open(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL with NORMAL sync keeps commits cheap while surviving process crashes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # Queues created before replies could fail lack the column
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(replies)")}
+        if "failed" not in columns:
+            self.connection.execute("ALTER TABLE replies ADD COLUMN failed INTEGER NOT NULL DEFAULT 0")
+        self.connection.commit()
+
+    async def get_offset(self) -> Optional[int]:
+        """Get the persisted getUpdates offset."""
+        return await self._run(self._get_offset)
+
+    def _get_offset(self) -> Optional[int]:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'offset'").fetchone()
+        return int(row[0]) if row else None
+
+    async def record_updates(self, updates: List[Dict[str, Any]]) -> Set[int]:
+        """
+        Store a batch of received updates and advance the offset in one transaction.
+
+        Args:
+            updates: Updates returned by getUpdates
+
+        Returns:
+            IDs of updates from the batch that were already processed
+        """
+        if not updates:
+            return set()
+        return await self._run(self._record_updates, updates)
+
+    def _record_updates(self, updates: List[Dict[str, Any]]) -> Set[int]:
+        now = time.time()
+        ids = [update["update_id"] for update in updates]
+        placeholders = ",".join("?" * len(ids))
+
+        with self.connection:
+            done = {
+                row[0] for row in self.connection.execute(
+                    f"SELECT update_id FROM updates WHERE done = 1 AND update_id IN ({placeholders})", ids
+                )
+            }
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO updates (update_id, payload, received_at) VALUES (?, ?, ?)",
+                [(update["update_id"], json.dumps(update, ensure_ascii=False), now) for update in updates]
+            )
+            self.connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('offset', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), excluded.value)",
+                (max(ids) + 1,)
+            )
+        return done
+
+    async def add_reply(self, update_id: int, chat_id: int, text: str, also_answers: Sequence[int] = ()) -> int:
+        """
+        Store a reply before it is sent.
+
+        Args:
+            update_id: Update the reply belongs to
+            chat_id: Chat the reply is sent to
+            text: Reply text
+            also_answers: Other updates answered by this reply, completed in the same transaction
+        """
+        return await self._run(self._add_reply, update_id, chat_id, text, list(also_answers))
+
+    def _add_reply(self, update_id: int, chat_id: int, text: str, also_answers: List[int]) -> int:
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO replies (update_id, chat_id, text) VALUES (?, ?, ?)",
+                (update_id, chat_id, text)
+            )
+            self.connection.executemany(
+                "UPDATE updates SET done = 1 WHERE update_id = ?", [(i,) for i in also_answers]
+            )
+        return cursor.lastrowid
+
+    async def mark_sent(self, reply_id: int):
+        """Mark a reply as accepted by Telegram."""
+        await self._run(self._mark_sent, reply_id)
+
+    def _mark_sent(self, reply_id: int):
+        with self.connection:
+            self.connection.execute("UPDATE replies SET sent = 1 WHERE id = ?", (reply_id,))
+
+    async def mark_failed(self, reply_id: int):
+        """Mark a reply Telegram will never accept, so it is not sent again."""
+        await self._run(self._mark_failed, reply_id)
+
+    def _mark_failed(self, reply_id: int):
+        with self.connection:
+            self.connection.execute("UPDATE replies SET failed = 1 WHERE id = ?", (reply_id,))
+
+    async def complete(self, update_id: int):
+        """Mark an update as fully processed."""
+        await self._run(self._complete, update_id)
+
+    def _complete(self, update_id: int):
+        with self.connection:
+            self.connection.execute("UPDATE updates SET done = 1 WHERE update_id = ?", (update_id,))
+
+    async def get_unfinished(self) -> List[Tuple[Dict[str, Any], List[Tuple[int, int, str, bool]]]]:
+        """
+        Get updates that were received but not completed before the last shutdown.
+
+        Returns:
+            List of (update, replies) where replies are (reply_id, chat_id, text, sent)
+            tuples of every reply already produced for the update; sent is also
+            true for replies that failed for good
+        """
+        return await self._run(self._get_unfinished)
+
+    def _get_unfinished(self) -> List[Tuple[Dict[str, Any], List[Tuple[int, int, str, bool]]]]:
+        result = []
+        rows = self.connection.execute(
+            "SELECT update_id, payload FROM updates WHERE done = 0 ORDER BY update_id"
+        ).fetchall()
+        for update_id, payload in rows:
+            replies = self.connection.execute(
+                "SELECT id, chat_id, text, sent OR failed FROM replies WHERE update_id = ? ORDER BY id",
+                (update_id,)
+            ).fetchall()
+            result.append((json.loads(payload), [(i, chat, text, bool(sent)) for i, chat, text, sent in replies]))
+        return result
+
+    async def prune(self, max_age: float):
+        """
+        Delete updates and their replies older than max_age seconds.
+
+        Unfinished updates are dropped too, so an update that keeps failing
+        is not retried forever.
+        """
+        await self._run(self._prune, max_age)
+
+    def _prune(self, max_age: float):
+        cutoff = time.time() - max_age
+        with self.connection:
+            abandoned = self.connection.execute(
+                "SELECT COUNT(*) FROM updates WHERE done = 0 AND received_at < ?", (cutoff,)
+            ).fetchone()[0]
+            self.connection.execute(
+                "DELETE FROM replies WHERE update_id IN "
+                "(SELECT update_id FROM updates WHERE received_at < ?)",
+                (cutoff,)
+            )
+            deleted = self.connection.execute(
+                "DELETE FROM updates WHERE received_at < ?", (cutoff,)
+            ).rowcount
+        if abandoned:
+            logger.warning(f"Dropped {abandoned} updates that were never completed from the queue")
+        if deleted:
+            logger.info(f"Pruned {deleted} updates from the queue")
+
+    async def close(self):
+        """Close the database."""
+        if self.connection is not None:
+            await self._run(self.connection.close)
+            self.connection = None
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,368 @@
+"""
+Token and cost accounting per user, chat and lore version.
+
+Every upstream request records its prompt, completion and cached tokens and
+its latency. Records are buffered in memory and written to SQLite in batches
+together with daily rollups. Today's totals are also kept in memory, so
+token quotas can be checked before an upstream call without touching disk.
+
+Usage:
+    python usage_tracker.py export --days 30 --output usage.csv
+"""
+
+import io
+import csv
+import sys
+import time
+import asyncio
+import sqlite3
+import logging
+import argparse
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    user_id INTEGER,
+    chat_id INTEGER,
+    lore_version TEXT,
+    model TEXT,
+    purpose TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    latency REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage_daily (
+    day TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    lore_version TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    latency_sum REAL NOT NULL,
+    PRIMARY KEY (day, user_id, chat_id, lore_version)
+);
+"""
+
+# Rollups use 0 and '' instead of NULL so that they can be part of the primary key
+ROLLUP_UPSERT = """
+INSERT INTO usage_daily VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+ON CONFLICT(day, user_id, chat_id, lore_version) DO UPDATE SET
+    requests = requests + 1,
+    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = completion_tokens + excluded.completion_tokens,
+    cached_tokens = cached_tokens + excluded.cached_tokens,
+    latency_sum = latency_sum + excluded.latency_sum
+"""
+
+def normalize_usage(usage: Optional[Dict[str, Any]]) -> Tuple[int, int, int]:
+    """
+    Extract token counts from a DeepSeek or OpenAI usage block.
+
+    Returns:
+        (prompt_tokens, completion_tokens, cached_tokens)
+    """
+    if not usage:
+        return 0, 0, 0
+
+    cached = usage.get("prompt_cache_hit_tokens")
+    if cached is None:
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+    return int(usage.get("prompt_tokens", 0)), int(usage.get("completion_tokens", 0)), int(cached or 0)
+
+class UsageTracker:
+    """Records token usage and enforces daily token quotas."""
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 5,
+        user_daily_quota: int = 0,
+        chat_daily_quota: int = 0,
+        prices: Tuple[float, float, float] = (0.028, 0.28, 0.42)
+    ):
+        """
+        Args:
+            path: SQLite database file
+            flush_interval: Seconds between batched writes
+            user_daily_quota: Tokens per user per day, 0 for unlimited
+            chat_daily_quota: Tokens per group chat per day, 0 for unlimited
+            prices: USD per million tokens for cached input, uncached input and output
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.user_daily_quota = user_daily_quota
+        self.chat_daily_quota = chat_daily_quota
+        self.prices = prices
+        self.connection: Optional[sqlite3.Connection] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="usage-tracker")
+        self.buffer: List[Tuple] = []
+        self.today = date.today().isoformat()
+        self.daily_tokens: Dict[Tuple[str, int], int] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, config: Config) -> "UsageTracker":
+        """Build the tracker from bot configuration."""
+        return cls(
+            config.USAGE_DB_PATH,
+            config.USAGE_FLUSH_INTERVAL,
+            config.USER_DAILY_TOKEN_QUOTA,
+            config.CHAT_DAILY_TOKEN_QUOTA,
+            (config.PRICE_INPUT_CACHE_HIT, config.PRICE_INPUT_CACHE_MISS, config.PRICE_OUTPUT)
+        )
+
+    def apply_config(self, config: Config):
+        """Pick up reloaded quotas and prices."""
+        self.user_daily_quota = config.USER_DAILY_TOKEN_QUOTA
+        self.chat_daily_quota = config.CHAT_DAILY_TOKEN_QUOTA
+        self.prices = (config.PRICE_INPUT_CACHE_HIT, config.PRICE_INPUT_CACHE_MISS, config.PRICE_OUTPUT)
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        """Open the database, restore today's totals and start periodic flushing."""
+        await self._run(self._open)
+        self.flush_task = asyncio.ensure_future(self._flush_periodically())
+        logger.info(f"Usage tracker opened at {self.path}")
+
+    def _open(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+        rows = self.connection.execute(
+            "SELECT user_id, chat_id, SUM(prompt_tokens + completion_tokens) FROM usage_daily "
+            "WHERE day = ? GROUP BY user_id, chat_id",
+            (self.today,)
+        ).fetchall()
+        for user_id, chat_id, tokens in rows:
+            self._add_daily(user_id or None, chat_id or None, tokens)
+
+    def _add_daily(self, user_id: Optional[int], chat_id: Optional[int], tokens: int):
+        if user_id:
+            self.daily_tokens[("user", user_id)] = self.daily_tokens.get(("user", user_id), 0) + tokens
+        if chat_id and chat_id != user_id:
+            self.daily_tokens[("chat", chat_id)] = self.daily_tokens.get(("chat", chat_id), 0) + tokens
+
+    def _roll_day(self):
+        today = date.today().isoformat()
+        if today != self.today:
+            self.today = today
+            self.daily_tokens = {}
+
+    def record(
+        self,
+        usage: Optional[Dict[str, Any]],
+        latency: float,
+        model: str = "",
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        lore_version: str = "",
+        purpose: str = "chat",
+        user_ids: Sequence[int] = ()
+    ):
+        """
+        Record one upstream request. The record is written with the next batch.
+
+        A request made for several players, like a scene round, is recorded
+        as one record per player with an equal share of the tokens, so their
+        rollups and quotas include it.
+
+        Args:
+            usage: Usage block of the API response
+            latency: Seconds the request took
+            model: Model name
+            user_id: Telegram user the request was made for
+            chat_id: Telegram chat the request was made for
+            lore_version: Version of the lore in the prompt
+            purpose: What the request was for ('chat', 'scene', 'world_state',
+                or 'hedge' for an attempt cancelled after another one won)
+            user_ids: Players sharing the request, used instead of user_id
+        """
+        tokens = normalize_usage(usage)
+        self._roll_day()
+        now = time.time()
+
+        participants = list(dict.fromkeys(user_ids)) or [user_id]
+        count = len(participants)
+        for index, participant in enumerate(participants):
+            # The first participant also takes the remainder, so the shares add up to the request
+            prompt_tokens, completion_tokens, cached_tokens = (
+                total // count + (total % count if index == 0 else 0) for total in tokens
+            )
+            self._add_daily(participant, chat_id, prompt_tokens + completion_tokens)
+            self.buffer.append((
+                now, participant, chat_id, lore_version, model, purpose,
+                prompt_tokens, completion_tokens, cached_tokens, latency
+            ))
+
+    def is_within_quota(self, user_id: Optional[int] = None, chat_id: Optional[int] = None) -> bool:
+        """Check today's token quotas of a user and of a group chat before an upstream call."""
+        self._roll_day()
+        if user_id and self.user_daily_quota and self.daily_tokens.get(("user", user_id), 0) >= self.user_daily_quota:
+            return False
+        if chat_id and self.chat_daily_quota and self.daily_tokens.get(("chat", chat_id), 0) >= self.chat_daily_quota:
+            return False
+        return True
+
+    def get_daily_tokens(self, user_id: int) -> int:
+        """Get the tokens a user has spent today."""
+        self._roll_day()
+        return self.daily_tokens.get(("user", user_id), 0)
+
+    async def flush(self):
+        """Write buffered records and update rollups in one transaction."""
+        if not self.buffer or self.connection is None:
+            return
+        records, self.buffer = self.buffer, []
+        await self._run(self._write, records)
+
+    def _write(self, records: List[Tuple]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO usage_records (ts, user_id, chat_id, lore_version, model, purpose, "
+                "prompt_tokens, completion_tokens, cached_tokens, latency) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+            self.connection.executemany(ROLLUP_UPSERT, [
+                (
+                    datetime.fromtimestamp(ts).date().isoformat(), user_id or 0, chat_id or 0,
+                    lore_version or "", prompt, completion, cached, latency
+                )
+                for ts, user_id, chat_id, lore_version, _, _, prompt, completion, cached, latency in records
+            ])
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write usage records: {e}")
+
+    def estimate_cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+        """Estimate the cost in USD from token counts."""
+        cache_hit_price, cache_miss_price, output_price = self.prices
+        return (
+            cached_tokens * cache_hit_price
+            + (prompt_tokens - cached_tokens) * cache_miss_price
+            + completion_tokens * output_price
+        ) / 1_000_000
+
+    async def get_summary(self, days: int = 1, top: int = 10) -> Dict[str, Any]:
+        """
+        Get usage totals over the last days from the rollups.
+
+        Returns:
+            Dictionary with 'totals', 'top_users', 'top_chats' and 'lore_versions'
+        """
+        await self.flush()
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        return await self._run(self._summary, since, top)
+
+    def _summary(self, since: str, top: int) -> Dict[str, Any]:
+        columns = (
+            "SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), "
+            "SUM(cached_tokens), SUM(latency_sum)"
+        )
+
+        def rows(group_by: str, where: str = "") -> List[Dict[str, Any]]:
+            result = []
+            for key, requests, prompt, completion, cached, latency_sum in self.connection.execute(
+                f"SELECT {group_by}, {columns} FROM usage_daily WHERE day >= ? {where} "
+                f"GROUP BY {group_by} ORDER BY SUM(prompt_tokens + completion_tokens) DESC LIMIT ?",
+                (since, top)
+            ):
+                result.append({
+                    "key": key,
+                    "requests": requests,
+                    "prompt_tokens": prompt,
+                    "completion_tokens": completion,
+                    "cached_tokens": cached,
+                    "avg_latency": latency_sum / requests if requests else 0.0,
+                    "cost": self.estimate_cost(prompt, completion, cached)
+                })
+            return result
+
+        totals = rows("'total'")
+        return {
+            "since": since,
+            "totals": totals[0] if totals else None,
+            "top_users": rows("user_id", "AND user_id != 0"),
+            "top_chats": rows("chat_id", "AND chat_id != 0"),
+            "lore_versions": rows("lore_version")
+        }
+
+    async def export_csv(self, days: int = 30) -> str:
+        """Export daily rollups of the last days as CSV."""
+        await self.flush()
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        return await self._run(self._export_csv, since)
+
+    def _export_csv(self, since: str) -> str:
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow([
+            "day", "user_id", "chat_id", "lore_version", "requests",
+            "prompt_tokens", "completion_tokens", "cached_tokens", "avg_latency", "cost_usd"
+        ])
+        for day, user_id, chat_id, lore_version, requests, prompt, completion, cached, latency_sum in self.connection.execute(
+            "SELECT * FROM usage_daily WHERE day >= ? ORDER BY day, user_id, chat_id", (since,)
+        ):
+            writer.writerow([
+                day, user_id or "", chat_id or "", lore_version, requests, prompt, completion, cached,
+                f"{latency_sum / requests:.3f}" if requests else "",
+                f"{self.estimate_cost(prompt, completion, cached):.6f}"
+            ])
+        return output.getvalue()
+
+    async def close(self):
+        """Flush pending records and close the database."""
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+        await self.flush()
+        if self.connection is not None:
+            await self._run(self.connection.close)
+            self.connection = None
+        self.executor.shutdown(wait=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Token usage accounting")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Export daily rollups as CSV")
+    export.add_argument("--days", type=int, default=30)
+    export.add_argument("--output", help="CSV file, standard output by default")
+    args = parser.parse_args()
+
+    async def run_export() -> str:
+        tracker = UsageTracker.from_config(Config())
+        await tracker.open()
+        try:
+            return await tracker.export_csv(args.days)
+        finally:
+            await tracker.close()
+
+    text = asyncio.run(run_export())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,15 @@ Utility functions and classes for the Telegram bot.
 import time
 import logging
 from collections import defaultdict, deque
-from typing import Dict, Deque
+from typing import Dict, Deque, Iterable, List, Optional, TypeVar
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Rough size of a token in characters, good enough for prompt size reports and estimates
+CHARS_PER_TOKEN = 3
+
 class RateLimiter:
     """Simple rate limiter to prevent spam."""
     
@@ -104,3 +109,44 @@ def sanitize_message(message: str, max_length: int = 4000) -> str:
         sanitized = sanitized[:max_length - 3] + "..."
     
     return sanitized
+
+def percentile(values: Iterable[float], fraction: float) -> Optional[float]:
+    """
+    Get a percentile of a set of samples.
+    
+    Args:
+        values: Samples
+        fraction: Percentile as a fraction (0.95 for p95)
+        
+    Returns:
+        Percentile value, or None if there are no samples
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
+
+def stable_window(items: List[T], limit: int) -> List[T]:
+    """
+    Get the tail of a list, at most limit long, whose start moves in steps.
+    
+    A plain sliding window drops one message per turn, so the beginning of
+    the prompt changes every time. Moving the start by half the limit at
+    once keeps the prompt prefix identical for many turns, which lets
+    prepared prefixes and the upstream context cache be reused.
+    
+    Args:
+        items: Full list
+        limit: Maximum length of the window
+        
+    Returns:
+        Tail of the list with between limit // 2 and limit elements
+    """
+    if len(items) <= limit:
+        return items
+    
+    step = max(1, limit // 2)
+    start = -(-(len(items) - limit) // step) * step
+    return items[start:]
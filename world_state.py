@@ -0,0 +1,267 @@
+"""
+Structured world-state memory extracted from the dialogue.
+
+After every assistant reply a small background request asks the model what
+changed in the scene (location, inventory, NPC relations, quests). The result
+is kept per session and injected into the system prompt as a compact block, so
+the prompt can carry far less raw chat history without losing continuity.
+"""
+
+import json
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_PROMPT = """Ты ведёшь учёт состояния ролевой игры. Тебе дают текущее состояние мира
+и последний ход (действие игрока и ответ рассказчика). Верни ТОЛЬКО JSON-объект с изменениями:
+{
+  "location": "новое местоположение героя или null, если не изменилось",
+  "inventory_add": ["предметы, которые герой получил"],
+  "inventory_remove": ["предметы, которые герой потерял или израсходовал"],
+  "npcs": {"Имя NPC": "краткое отношение к герою и последнее, что о нём известно"},
+  "quests_add": ["новые задания или цели"],
+  "quests_done": ["выполненные или проваленные задания"]
+}
+Не выдумывай то, чего нет в тексте. Пустые списки и объекты допустимы."""
+
+def _as_list(value: Any) -> List[Any]:
+    """Coerce a list field of the model's answer, accepting a lone string."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str) and value.strip():
+        return [value]
+    return []
+
+class WorldState:
+    """World state of a single session."""
+
+    MAX_ITEMS = 30
+
+    def __init__(self):
+        self.location: str = ""
+        self.inventory: List[str] = []
+        self.npcs: Dict[str, str] = {}
+        self.quests: List[str] = []
+        self.turns: int = 0
+
+    def is_empty(self) -> bool:
+        """Check whether anything has been recorded yet."""
+        return not (self.location or self.inventory or self.npcs or self.quests)
+
+    def apply_update(self, update: Dict[str, Any]):
+        """
+        Apply changes extracted from an assistant reply.
+
+        Args:
+            update: Dictionary in the format requested by EXTRACTION_PROMPT
+        """
+        location = update.get("location")
+        if isinstance(location, str) and location.strip() and location.strip().lower() != "null":
+            self.location = location.strip()
+
+        removed = {str(item).strip().lower() for item in _as_list(update.get("inventory_remove"))}
+        self.inventory = [item for item in self.inventory if item.lower() not in removed]
+        for item in _as_list(update.get("inventory_add")):
+            item = str(item).strip()
+            if item and item.lower() not in (i.lower() for i in self.inventory):
+                self.inventory.append(item)
+
+        npcs = update.get("npcs") or {}
+        if isinstance(npcs, dict):
+            for name, relation in npcs.items():
+                if str(name).strip() and relation:
+                    self.npcs[str(name).strip()] = str(relation).strip()
+
+        done = {str(quest).strip().lower() for quest in _as_list(update.get("quests_done"))}
+        self.quests = [quest for quest in self.quests if quest.lower() not in done]
+        for quest in _as_list(update.get("quests_add")):
+            quest = str(quest).strip()
+            if quest and quest.lower() not in (q.lower() for q in self.quests):
+                self.quests.append(quest)
+
+        # Keep the block small no matter how long the campaign runs
+        self.inventory = self.inventory[-self.MAX_ITEMS:]
+        self.quests = self.quests[-self.MAX_ITEMS:]
+        if len(self.npcs) > self.MAX_ITEMS:
+            self.npcs = dict(list(self.npcs.items())[-self.MAX_ITEMS:])
+
+        self.turns += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the state."""
+        return {
+            "location": self.location,
+            "inventory": self.inventory,
+            "npcs": self.npcs,
+            "quests": self.quests
+        }
+
+    def to_prompt_block(self) -> str:
+        """Render the state as a block for the system prompt."""
+        if self.is_empty():
+            return ""
+
+        npcs = "; ".join(f"{name} — {relation}" for name, relation in self.npcs.items())
+        return (
+            "=== ТЕКУЩЕЕ СОСТОЯНИЕ МИРА ===\n"
+            f"Локация: {self.location or 'неизвестно'}\n"
+            f"Инвентарь: {', '.join(self.inventory) or 'пусто'}\n"
+            f"Встреченные персонажи: {npcs or 'нет'}\n"
+            f"Активные задания: {'; '.join(self.quests) or 'нет'}\n"
+            "=== КОНЕЦ СОСТОЯНИЯ ==="
+        )
+
+def parse_update(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Extract the JSON object from the model's answer.
+
+    Args:
+        text: Raw answer, possibly wrapped in a code fence
+
+    Returns:
+        Parsed dictionary or None if the answer is not valid JSON
+    """
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+    return data if isinstance(data, dict) else None
+
+class WorldStateManager:
+    """Keeps world states per session and updates them in the background."""
+
+    def __init__(self, deepseek_client):
+        self.deepseek_client = deepseek_client
+        self.states: Dict[Any, WorldState] = {}
+        # Locks exist only while a session has extractions scheduled
+        self.locks: Dict[Any, asyncio.Lock] = {}
+        self.scheduled: Dict[Any, int] = {}
+        self.tasks: Set[asyncio.Task] = set()
+
+    def get_state(self, session_id) -> WorldState:
+        """Get the world state of a session, creating an empty one if needed."""
+        if session_id not in self.states:
+            self.states[session_id] = WorldState()
+        return self.states[session_id]
+
+    def get_prompt_block(self, session_id) -> str:
+        """Get the prompt block for a session, empty if nothing is known yet."""
+        state = self.states.get(session_id)
+        return state.to_prompt_block() if state else ""
+
+    def schedule_update(
+        self,
+        session_id,
+        user_text: str,
+        assistant_reply: str,
+        usage_tags: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Start a background extraction for the latest turn.
+
+        Updates of one session are applied in the order they were scheduled.
+
+        Args:
+            session_id: Session key (user or chat ID)
+            user_text: Player's message
+            assistant_reply: Narrator's reply to it
+            usage_tags: Attribution of the extraction request for usage accounting
+        """
+        # Bound to the state of this turn, so a reset in between discards the update
+        state = self.get_state(session_id)
+        lock = self.locks.setdefault(session_id, asyncio.Lock())
+        self.scheduled[session_id] = self.scheduled.get(session_id, 0) + 1
+        task = asyncio.ensure_future(
+            self._update(session_id, state, lock, user_text, assistant_reply, usage_tags)
+        )
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _update(
+        self,
+        session_id,
+        state: WorldState,
+        lock: asyncio.Lock,
+        user_text: str,
+        assistant_reply: str,
+        usage_tags: Optional[Dict[str, Any]]
+    ):
+        try:
+            async with lock:
+                await self._extract(session_id, state, user_text, assistant_reply, usage_tags)
+        finally:
+            if self.locks.get(session_id) is lock:
+                self.scheduled[session_id] -= 1
+                if not self.scheduled[session_id]:
+                    del self.scheduled[session_id]
+                    del self.locks[session_id]
+
+    async def _extract(
+        self,
+        session_id,
+        state: WorldState,
+        user_text: str,
+        assistant_reply: str,
+        usage_tags: Optional[Dict[str, Any]]
+    ):
+        if self.states.get(session_id) is not state:
+            return
+
+        request = (
+            f"Текущее состояние:\n{json.dumps(state.to_dict(), ensure_ascii=False)}\n\n"
+            f"Действие игрока:\n{user_text}\n\n"
+            f"Ответ рассказчика:\n{assistant_reply}"
+        )
+
+        try:
+            answer = await self.deepseek_client.get_response(
+                [{"role": "user", "content": request}],
+                system_prompt=EXTRACTION_PROMPT,
+                temperature=0.0,
+                max_tokens=500,
+                usage_tags=dict(usage_tags or {}, purpose="world_state"),
+                # Short extraction calls would pull the chat hedging deadline down
+                record_latency=False
+            )
+        except Exception as e:
+            logger.warning(f"World state extraction failed for session {session_id}: {e}")
+            return
+
+        update = parse_update(answer)
+        if update is None:
+            logger.warning(f"World state extraction returned invalid JSON for session {session_id}")
+            return
+
+        # The session may have been reset while the request was running
+        if self.states.get(session_id) is state:
+            state.apply_update(update)
+            logger.debug(f"Updated world state for session {session_id}: {state.to_dict()}")
+
+    async def wait_idle(self, session_id):
+        """Wait until the updates already scheduled for a session are applied."""
+        lock = self.locks.get(session_id)
+        if lock is not None:
+            async with lock:
+                pass
+
+    def reset(self, session_id):
+        """Forget the world state of a session."""
+        self.states.pop(session_id, None)
+        # Extractions still running finish on their own lock and find the state gone
+        self.locks.pop(session_id, None)
+        self.scheduled.pop(session_id, None)
+
+    async def close(self):
+        """Cancel pending extractions."""
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)